@@ -0,0 +1,5 @@
+import sys
+
+from myoraw.cli import main
+
+sys.exit(main())
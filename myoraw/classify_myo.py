@@ -7,21 +7,13 @@ import time
 
 import numpy as np
 
-try:
-    from sklearn import neighbors, svm
-    HAVE_SK = True
-except ImportError:
-    HAVE_SK = False
-
-try:
-    import pygame
-    from pygame.locals import *
-    HAVE_PYGAME = True
-except ImportError:
-    HAVE_PYGAME = False
+from myoraw.common import *
+from myoraw import myo
 
-from common import *
-import myo
+## the display is redrawn at most FPS times per second, and the nearest
+## neighbours of the current reading are looked up NEIGHBOUR_HZ times
+FPS = 30
+NEIGHBOUR_HZ = 5
 
 class EMGHandler(object):
     def __init__(self, m):
@@ -34,24 +26,48 @@ class EMGHandler(object):
         if self.recording >= 0:
             self.m.cls.store_data(self.recording, emg)
 
-if __name__ == '__main__':
+def main(tty=None, gui=True):
+    '''Runs the training and classification display, with pygame if gui
+    and it is installed.'''
+    ## without pygame (or with gui=False), the histogram goes to the terminal
+    HAVE_PYGAME = False
+    if gui:
+        try:
+            import pygame
+            from pygame.locals import QUIT, KEYDOWN, KEYUP, K_0, K_9, K_KP0, K_KP9
+            HAVE_PYGAME = True
+        except ImportError:
+            pass
+
     if HAVE_PYGAME:
         pygame.init()
         w, h = 800, 320
         scr = pygame.display.set_mode((w, h))
         font = pygame.font.Font(None, 30)
 
-    m = myo.Myo(myo.NNClassifier(), sys.argv[1] if len(sys.argv) >= 2 else None)
+    m = myo.Myo(myo.NNClassifier(), tty)
     hnd = EMGHandler(m)
     m.add_emg_handler(hnd)
     m.connect()
 
+    neighbours = []
+    t_neighbours = 0
+
     try:
         while True:
-            m.run()
+            ## receive everything that comes in until the next frame is due,
+            ## rather than a single packet per frame
+            t_frame = time.time() + 1. / FPS
+            while time.time() < t_frame:
+                m.run(t_frame - time.time())
 
             r = m.history_cnt.most_common(1)[0][0]
 
+            if myo.HAVE_SK and m.cls.nn is not None and time.time() - t_neighbours >= 1. / NEIGHBOUR_HZ:
+                t_neighbours = time.time()
+                dists, inds = m.cls.nn.kneighbors([hnd.emg])
+                neighbours = [(m.cls.Y[m.cls.subsample*ind], d) for d, ind in zip(dists[0], inds[0])]
+
             if HAVE_PYGAME:
                 for ev in pygame.event.get():
                     if ev.type == QUIT or (ev.type == KEYDOWN and ev.unicode == 'q'):
@@ -60,9 +76,9 @@ if __name__ == '__main__':
                         if K_0 <= ev.key <= K_9:
                             hnd.recording = ev.key - K_0
                         elif K_KP0 <= ev.key <= K_KP9:
-                            hnd.recording = ev.key - K_Kp0
+                            hnd.recording = ev.key - K_KP0
                         elif ev.unicode == 'r':
-                            hnd.cl.read_data()
+                            m.cls.read_data()
                     elif ev.type == KEYUP:
                         if K_0 <= ev.key <= K_9 or K_KP0 <= ev.key <= K_KP9:
                             hnd.recording = -1
@@ -75,21 +91,17 @@ if __name__ == '__main__':
 
                     clr = (0,200,0) if i == r else (255,255,255)
 
-                    txt = font.render('%5d' % (m.cls.Y == i).sum(), True, (255,255,255))
-                    scr.blit(txt, (x + 20, y))
+                    text(scr, font, '%5d' % m.cls.counts[i], (x + 20, y))
 
-                    txt = font.render('%d' % i, True, clr)
+                    txt = render(font, '%d' % i, clr)
                     scr.blit(txt, (x + 110, y))
 
 
                     scr.fill((0,0,0), (x+130, y + txt.get_height() / 2 - 10, len(m.history) * 20, 20))
                     scr.fill(clr, (x+130, y + txt.get_height() / 2 - 10, m.history_cnt[i] * 20, 20))
 
-                if HAVE_SK and m.cls.nn is not None:
-                    dists, inds = m.cls.nn.kneighbors(hnd.emg)
-                    for i, (d, ind) in enumerate(zip(dists[0], inds[0])):
-                        y = m.cls.Y[myo.SUBSAMPLE*ind]
-                        text(scr, font, '%d %6d' % (y, d), (650, 20 * i))
+                for i, (y, d) in enumerate(neighbours):
+                    text(scr, font, '%d %6d' % (y, d), (650, 20 * i))
 
                 pygame.display.flip()
             else:
@@ -108,3 +120,7 @@ if __name__ == '__main__':
 
     if HAVE_PYGAME:
         pygame.quit()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) >= 2 else None)
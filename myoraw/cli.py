@@ -0,0 +1,380 @@
+'''The myosport command:
+
+  myosport record OUTPUT --player N --type T   records gestures into a file
+  myosport classify [--gui]                    reports poses as they happen
+  myosport serve [ADDRESS]                     serves the data to local programs
+  myosport replay RECORDING...                 plays recordings back as if live
+
+A subcommand imports what it needs only when it runs: numpy, sklearn and
+pygame take most of the startup time on a small board, and record or
+serve --no-classify need none of them. --import-time reports, once the
+subcommand is ready, how long each of its imports took (run Python with
+-X importtime for the details).'''
+
+from __future__ import print_function
+
+import argparse
+import importlib
+import sys
+import time
+from time import perf_counter
+
+## when this module was imported, i.e. about when the command started
+T_START = perf_counter()
+
+## (module, seconds) for every import made through load(), in order
+import_times = []
+
+def load(name):
+    '''Imports a module by name, timing the import; the modules it imports
+    that were not imported before count in its time.'''
+    t0 = perf_counter()
+    mod = importlib.import_module(name)
+    import_times.append((name, perf_counter() - t0))
+    return mod
+
+def load_classifier():
+    '''Imports myoraw.myo, and sklearn now rather than at the classifier's
+    first fit, so that it shows in the import times.'''
+    load('numpy')
+    myo = load('myoraw.myo')
+    if myo.HAVE_SK:
+        load('sklearn.neighbors')
+    return myo
+
+def load_nn(myo, directory):
+    '''Returns an NNClassifier trained on the vals*.dat files of directory,
+    which are only read.'''
+    cls = myo.NNClassifier.from_files(directory)
+    if not len(cls.X):
+        print('no training data (vals*.dat) in %s' % directory, file=sys.stderr)
+    return cls
+
+def report(args):
+    '''Prints the import times, if asked to; to be called when the subcommand
+    is about to start its work.'''
+    if not args.import_time: return
+    total = perf_counter() - T_START
+    for name, t in import_times:
+        print('import %-24s %7.1f ms' % (name, t * 1e3), file=sys.stderr)
+    print('ready after %.1f ms, %.1f ms of it importing' %
+          (total * 1e3, sum(t for _, t in import_times) * 1e3), file=sys.stderr)
+
+def print_pose(prefix, pose):
+    print('%s pose %d' % (prefix, pose))
+    sys.stdout.flush()
+
+def print_stroke(prefix, label, distance):
+    print('%s stroke %d (distance %.0f)' % (prefix, label, distance))
+    sys.stdout.flush()
+
+def load_strokes(m, templates):
+    '''Returns a dtw.StrokeDetector attached to m that classifies strokes
+    against the gestures of the given recording files, or None if there are
+    none.'''
+    if not templates: return None
+    dtw = load('myoraw.dtw')
+    cls = dtw.DTWClassifier()
+    cls.load(templates)
+    strokes = dtw.StrokeDetector(cls)
+    strokes.attach(m)
+    return strokes
+
+
+def record(args):
+    '''Records a gesture of args.samples EMG readings, with the IMU readings
+    that came last, each time Enter is pressed. A gesture interrupted by a
+    loss of the link is dropped.'''
+    import os
+    import queue
+    import threading
+
+    data_file = load('myoraw.data_file')
+    myo_raw = load('myoraw.myo_raw')
+
+    if args.type.isdigit():
+        gesture_type = data_file.GestureType(int(args.type))
+    elif args.type.upper() in data_file.GestureType.__members__:
+        gesture_type = data_file.GestureType[args.type.upper()]
+    else:
+        raise ValueError('unknown gesture type %s' % args.type)
+    ## recording files can't hold these, so refuse them before recording
+    if gesture_type == data_file.GestureType.UNKNOWN:
+        raise ValueError('gesture type %s is not recordable' % args.type)
+    if args.player < 0:
+        raise ValueError('player must be 0 or more, not %d' % args.player)
+
+    m = myo_raw.MyoRaw(args.tty)
+    rec = data_file.Recording()
+    rec.set_player_id(args.player)
+    rec.set_gesture_type(gesture_type)
+    rec.file_header.rec_frame_rate = m.EMG_HZ
+
+    imu = [(0,) * 4, (0,) * 3, (0,) * 3]
+    gesture = [None]
+
+    def on_imu(quat, acc, gyro):
+        imu[:] = quat, acc, gyro
+
+    def on_emg(emg, moving):
+        g = gesture[0]
+        if g is None: return
+        g.append_sample(emg, *imu)
+        if g.header.samples_nbr >= args.samples:
+            rec.append_gesture(g)
+            gesture[0] = None
+            print('gesture %d recorded' % len(rec.gestures))
+            sys.stdout.flush()
+
+    def on_gap(t_lost, t_back):
+        ## the samples on both sides of a gap don't make one stroke
+        if gesture[0] is not None:
+            gesture[0] = None
+            print('link lost during the gesture, which was dropped; '
+                  'press Enter to record it again')
+            sys.stdout.flush()
+
+    m.add_imu_handler(on_imu)
+    m.add_emg_handler(on_emg)
+    m.add_gap_handler(on_gap)
+
+    ## Enter is waited for in another thread, so that the dongle is read
+    ## meanwhile; False means the end of the input
+    presses = queue.Queue()
+    def read_input():
+        for _ in sys.stdin:
+            presses.put(True)
+        presses.put(False)
+    reader = threading.Thread(target=read_input)
+    reader.daemon = True
+    reader.start()
+
+    m.connect()
+    report(args)
+    print('press Enter to record a gesture, Ctrl-D to stop')
+    sys.stdout.flush()
+
+    stopping = False
+    try:
+        ## a gesture being recorded is finished before stopping
+        while gesture[0] is not None or not stopping:
+            m.run(.1)
+            while not presses.empty():
+                if not presses.get():
+                    stopping = True
+                elif gesture[0] is None:
+                    gesture[0] = data_file.Gesture()
+            if args.gestures is not None and len(rec.gestures) >= args.gestures:
+                stopping = True
+    except KeyboardInterrupt:
+        pass
+    finally:
+        m.disconnect()
+
+    if not rec.gestures:
+        print('no gesture recorded')
+        return 1
+    ## a failed write must not truncate an existing OUTPUT
+    temp_path = '%s.%d.tmp' % (args.output, os.getpid())
+    try:
+        with open(temp_path, 'wb') as f:
+            rec.pack_into_file(f)
+        os.replace(temp_path, args.output)
+    finally:
+        if os.path.exists(temp_path): os.remove(temp_path)
+    print('%s: %d gestures' % (args.output, len(rec.gestures)))
+    return 0
+
+
+def classify(args):
+    '''Prints the poses of the classifier trained with classify_myo, or runs
+    classify_myo's display with --gui.'''
+    if args.gui:
+        load_classifier()
+        try:
+            load('pygame')
+        except ImportError:
+            pass
+        classify_myo = load('myoraw.classify_myo')
+        report(args)
+        classify_myo.main(args.tty)
+        return 0
+
+    myo = load_classifier()
+    m = myo.Myo(load_nn(myo, args.training), args.tty)
+    m.add_raw_pose_handler(lambda pose: print_pose('%.3f' % time.time(), pose))
+    m.connect()
+    report(args)
+
+    try:
+        while True:
+            m.run(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        m.disconnect()
+    return 0
+
+
+def serve(args):
+    '''Serves the data of the Myo through a StreamServer, as
+    stream_server.py does, and through a shared-memory ring with --ring.'''
+    stream_server = load('myoraw.stream_server')
+
+    if args.no_classify:
+        m = load('myoraw.myo_raw').MyoRaw(args.tty)
+    else:
+        myo = load_classifier()
+        m = myo.Myo(load_nn(myo, args.training), args.tty)
+
+    address = args.address
+    if address.isdigit():
+        address = ('127.0.0.1', int(address))
+    strokes = load_strokes(m, args.templates)
+    server = stream_server.StreamServer(address)
+    daemon = stream_server.StreamDaemon(m, server, strokes=strokes)
+    ring = None
+    if args.ring:
+        ring = load('myoraw.shm_ring').RingWriter(args.ring)
+        ring.attach(m)
+
+    try:
+        m.connect()
+        report(args)
+        print('serving on', server.address)
+        sys.stdout.flush()
+        while True:
+            daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        m.disconnect()
+        server.close()
+        if ring is not None: ring.close()
+    return 0
+
+
+def replay(args):
+    '''Feeds the samples of recordings to a Myo as if they came from the
+    dongle, at their recorded rate times args.speed (0 for as fast as
+    possible), printing its poses and serving its data with --serve.'''
+    data_file = load('myoraw.data_file')
+
+    where = ['']
+    if args.no_classify:
+        m = load('myoraw.myo_raw').MyoRaw('loop://')
+    else:
+        myo = load_classifier()
+        m = myo.Myo(load_nn(myo, args.training), 'loop://')
+        m.add_raw_pose_handler(lambda pose: print_pose(where[0], pose))
+    strokes = load_strokes(m, args.templates)
+    if strokes is not None:
+        strokes.add_handler(lambda label, distance: print_stroke(where[0], label, distance))
+
+    server = daemon = None
+    if args.serve:
+        stream_server = load('myoraw.stream_server')
+        address = ('127.0.0.1', int(args.serve)) if args.serve.isdigit() else args.serve
+        server = stream_server.StreamServer(address)
+        daemon = stream_server.StreamDaemon(m, server, strokes=strokes)
+        print('serving on', server.address)
+
+    def wait(until):
+        while True:
+            left = until - time.time()
+            if left <= 0: return
+            if server is not None: server.poll(left)
+            else: time.sleep(left)
+
+    report(args)
+    try:
+        t_next = time.time()
+        for path in args.recordings:
+            with open(path, 'rb') as f:
+                rec = data_file.Recording.unpack_from_file(f)
+            period = 0
+            if args.speed > 0:
+                period = 1. / (rec.file_header.rec_frame_rate * args.speed)
+            for i, g in enumerate(rec.gestures):
+                where[0] = '%s #%d' % (path, i)
+                for s in g.samples:
+                    m.on_imu(s.quat, s.acc, s.gyro)
+                    m.on_emg(s.emg, 0)
+                    if period:
+                        t_next += period
+                        wait(t_next)
+                    elif server is not None:
+                        server.poll(0)
+        if daemon is not None:
+            daemon.flush()
+            wait(time.time() + .1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None: server.close()
+    return 0
+
+
+COMMANDS = {'record': record, 'classify': classify, 'serve': serve, 'replay': replay}
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='myosport', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--import-time', action='store_true',
+                        help='report how long the imports took, on stderr')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    cmd = commands.add_parser('record', help='record gestures, one each time Enter is pressed')
+    cmd.add_argument('output')
+    cmd.add_argument('--player', type=int, required=True)
+    cmd.add_argument('--type', required=True, help='gesture type, by name or number')
+    cmd.add_argument('--samples', type=int, default=100,
+                     help='EMG readings per gesture (default: 100)')
+    cmd.add_argument('--gestures', type=int, help='stop after this many gestures')
+    cmd.add_argument('--tty', help='the dongle, if not auto-detected')
+
+    cmd = commands.add_parser('classify', help='print the poses as they happen')
+    cmd.add_argument('--gui', action='store_true',
+                     help="run classify_myo's training display instead")
+    cmd.add_argument('--training', default='.', metavar='DIR',
+                     help='without --gui, the directory of the training data (vals*.dat), '
+                     'which is only read (default: .)')
+    cmd.add_argument('--tty', help='the dongle, if not auto-detected')
+
+    cmd = commands.add_parser('serve', help='serve the data to local programs')
+    cmd.add_argument('address', nargs='?', default='/tmp/myosport.sock',
+                     help='a socket path, or a port on 127.0.0.1')
+    cmd.add_argument('--ring', help='also publish in the shared-memory ring of this name')
+    cmd.add_argument('--no-classify', action='store_true',
+                     help='serve raw data only, without numpy nor sklearn')
+    cmd.add_argument('--training', default='.', metavar='DIR',
+                     help='the directory of the training data (vals*.dat), which is only read (default: .)')
+    cmd.add_argument('--templates', nargs='+', metavar='RECORDING',
+                     help='serve stroke classifications against these gestures')
+    cmd.add_argument('--tty', help='the dongle, if not auto-detected')
+
+    cmd = commands.add_parser('replay', help='play recordings back as if live')
+    cmd.add_argument('recordings', nargs='+')
+    cmd.add_argument('--speed', type=float, default=1.,
+                     help='times the recorded rate, 0 for as fast as possible')
+    cmd.add_argument('--serve', metavar='ADDRESS',
+                     help='serve the data on this socket path or port')
+    cmd.add_argument('--no-classify', action='store_true')
+    cmd.add_argument('--training', default='.', metavar='DIR',
+                     help='the directory of the training data (vals*.dat), which is only read (default: .)')
+    cmd.add_argument('--templates', nargs='+', metavar='RECORDING',
+                     help='classify strokes against these gestures')
+    return parser
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    try:
+        return COMMANDS[args.command](args)
+    except (ValueError, IOError) as error:
+        print('### ERROR: %s' % error)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
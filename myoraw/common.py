@@ -6,5 +6,16 @@ def pack(fmt, *args):
 def unpack(fmt, *args):
     return struct.unpack('<' + fmt, *args)
 
+## rendered text surfaces, by (font, text, color)
+_glyphs = {}
+
+def render(font, txt, clr=(255,255,255)):
+    key = (font, txt, clr)
+    surf = _glyphs.get(key)
+    if surf is None:
+        if len(_glyphs) > 4096: _glyphs.clear()
+        surf = _glyphs[key] = font.render(txt, True, clr)
+    return surf
+
 def text(scr, font, txt, pos, clr=(255,255,255)):
-    scr.blit(font.render(txt, True, clr), pos)
+    scr.blit(render(font, txt, clr), pos)
@@ -0,0 +1,109 @@
+from __future__ import print_function
+
+import numpy as np
+
+## a label is emitted once the evidence gathered since the stream started
+## disagreeing with the last decision makes it CONFIDENCE likely to beat the
+## runner-up...
+CONFIDENCE = 0.9
+## ...or unconditionally after MAX_LATENCY samples of disagreement
+MAX_LATENCY = 25
+## pseudo-count added to both contenders, so that a few samples are never
+## enough on their own
+PRIOR = 1.0
+
+
+class EarlyDecision(object):
+    '''Streaming decision engine: accumulates per-class evidence and emits a
+    label as soon as it's confident enough, instead of waiting for a fixed
+    window to fill.
+
+    Each call to update() takes either a class number (a vote) or a vector of
+    class probabilities. Evidence only starts accumulating when the stream
+    disagrees with the last emitted label, and is dropped if it swings back to
+    it.'''
+
+    def __init__(self, n_classes=10, confidence=CONFIDENCE, max_latency=MAX_LATENCY,
+                 prior=PRIOR):
+        self.n_classes = n_classes
+        self.confidence = confidence
+        self.max_latency = max_latency
+        self.prior = prior
+
+        self.last = None
+        ## number of samples each decision took, counted from the first sample
+        ## that disagreed with the previous one
+        self.latencies = []
+        self.reset()
+
+    def reset(self):
+        self.evidence = np.zeros(self.n_classes)
+        self.pending = 0
+
+    def leader(self):
+        '''Returns the leading class and the posterior mean of it beating the
+        runner-up, given the evidence so far.'''
+        r, s = np.argsort(self.evidence)[::-1][:2]
+        a, b = self.evidence[r] + self.prior, self.evidence[s] + self.prior
+        return int(r), a / (a + b)
+
+    def update(self, y):
+        '''Adds one sample of evidence; returns the newly decided label, or
+        None.'''
+        if np.ndim(y) == 0:
+            if y == self.last and not self.pending: return None
+            self.evidence[int(y)] += 1
+        else:
+            y = np.asarray(y, dtype=np.float64)
+            if self.last is not None and not self.pending and y.argmax() == self.last:
+                return None
+            self.evidence += y
+        self.pending += 1
+
+        r, p = self.leader()
+        if r == self.last:
+            ## the stream came back to the current decision
+            self.reset()
+            return None
+
+        if self.last is None or p >= self.confidence or self.pending >= self.max_latency:
+            self.latencies.append(self.pending)
+            self.last = r
+            self.reset()
+            return r
+        return None
+
+
+def latency_accuracy_curve(stream, confidences, **kw):
+    '''Runs an EarlyDecision over stream, a sequence of (evidence, true label)
+    pairs, once for each confidence bound, and returns a list of
+    (confidence, mean latency, accuracy) tuples.
+
+    Latency is the number of samples between a change of the true label and
+    the first correct decision for it; accuracy is the fraction of emitted
+    decisions that matched the true label at the time they were made.'''
+    curve = []
+    for c in confidences:
+        dec = EarlyDecision(confidence=c, **kw)
+        truth = None
+        since = 0
+        waiting = False
+        lat = []
+        ok = n = 0
+        for y, t in stream:
+            if t != truth:
+                truth, since, waiting = t, 0, True
+            since += 1
+
+            r = dec.update(y)
+            if r is None: continue
+            n += 1
+            if r == truth:
+                ok += 1
+                if waiting:
+                    lat.append(since)
+                    waiting = False
+
+        curve.append((c, np.mean(lat) if lat else float('nan'),
+                      ok / float(n) if n else float('nan')))
+    return curve
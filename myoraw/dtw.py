@@ -0,0 +1,334 @@
+from __future__ import print_function
+
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from myoraw.data_file import Recording
+
+## length every template and query is resampled to before comparison
+LENGTH = 64
+## half-width of the Sakoe-Chiba band, as a fraction of LENGTH
+WINDOW = 0.1
+## number of candidates whose full DTW is computed together
+CHUNK = 32
+## number of candidates, in LB_Kim order, whose LB_Keogh is computed together
+BLOCK = 512
+
+
+def gesture_to_array(gesture, fields=('emg',)):
+    '''Converts a data_file.Gesture into a (samples, channels) float array made
+    of the given GestureSample fields, in order.'''
+    return np.array([sum((getattr(s, f) for f in fields), ()) for s in gesture.samples],
+                    dtype=np.float64)
+
+def resample(series, length):
+    '''Linearly resamples a (samples, channels) array to the given number of
+    samples.'''
+    series = np.asarray(series, dtype=np.float64)
+    if series.ndim == 1:
+        series = series[:, None]
+    n = series.shape[0]
+    if n == length:
+        return series.copy()
+    src = np.linspace(0, n - 1, length)
+    lo = np.floor(src).astype(int)
+    hi = np.minimum(lo + 1, n - 1)
+    frac = (src - lo)[:, None]
+    return series[lo] * (1 - frac) + series[hi] * frac
+
+def envelopes(series, r):
+    '''Returns the (lower, upper) LB_Keogh envelopes of an array of shape
+    (..., samples, channels) for a band of half-width r, computed for all the
+    series at once.'''
+    n = series.shape[-2]
+    pad = [(0, 0)] * series.ndim
+    pad[-2] = (r, r)
+    padded = np.pad(series, pad, mode='edge')
+    lower = series.copy()
+    upper = series.copy()
+    for k in range(2 * r + 1):
+        np.minimum(lower, padded[..., k:k + n, :], out=lower)
+        np.maximum(upper, padded[..., k:k + n, :], out=upper)
+    return lower, upper
+
+
+class DTWClassifier(object):
+    '''Nearest-template classifier for whole gestures, using multivariate DTW
+    constrained to a Sakoe-Chiba band.
+
+    Candidates go through a cascade of lower bounds (LB_Kim, then LB_Keogh
+    against precomputed template envelopes) and the surviving ones have their
+    DTW computed together, abandoning each as soon as it can't beat the best
+    distance found so far. Templates and envelopes are kept as float32, which
+    halves the memory the bounds go through.'''
+
+    def __init__(self, length=LENGTH, window=WINDOW, fields=('emg',), chunk=CHUNK,
+                 block=BLOCK):
+        self.length = length
+        self.r = max(0, int(round(window * length)))
+        self.fields = fields
+        self.chunk = chunk
+        self.block = block
+
+        self._series = []
+        self._labels = []
+        self.templates = None
+
+        ## pruning counters, for tuning window/length
+        self.stats = dict(queries=0, kim=0, keogh=0, abandoned=0, full=0)
+
+    def add_template(self, label, series):
+        self._series.append(resample(series, self.length))
+        self._labels.append(int(label))
+        self.templates = None
+
+    def add_recording(self, recording):
+        label = recording.file_header.gesture_type
+        for g in recording.gestures:
+            self.add_template(label, gesture_to_array(g, self.fields))
+
+    def load(self, paths):
+        '''Adds every gesture of the given recording files as templates of their
+        file's gesture type.'''
+        for path in paths:
+            with open(path, 'rb') as f:
+                self.add_recording(Recording.unpack_from_file(f))
+        self.fit()
+
+    def fit(self):
+        if not self._series:
+            raise ValueError('no templates')
+        self.templates = np.array(self._series, dtype=np.float32)
+        self.labels = np.array(self._labels)
+        self.lower, self.upper = envelopes(self.templates, self.r)
+        self.first = self.templates[:, 0]
+        self.last = self.templates[:, -1]
+
+    def lb_kim(self, q):
+        '''Every warping path goes through both corners of the cost matrix.'''
+        return (((self.first - q[0])**2).sum(1) +
+                ((self.last - q[-1])**2).sum(1))
+
+    def lb_keogh(self, q, inds):
+        d = self.lower[inds]
+        np.clip(q, d, self.upper[inds], out=d)
+        d -= q
+        return np.einsum('ijk,ijk->i', d, d)
+
+    def dtw(self, q, inds, best=np.inf):
+        '''Banded DTW between q and the templates inds, computed for all of
+        them at once, one row of the cost matrix at a time. Returns the
+        distances, set to inf for abandoned candidates.'''
+        n, r = self.length, self.r
+        out = np.full(len(inds), np.inf)
+        alive = np.arange(len(inds))
+        T = self.templates[inds]
+
+        prev = np.full((len(inds), n + 1), np.inf)
+        prev[:, 0] = 0
+        for i in range(n):
+            lo, hi = max(0, i - r), min(n, i + r + 1)
+            cost = ((T[:, lo:hi] - q[i])**2).sum(2)
+            ## diagonal and vertical moves only depend on the previous row
+            a = cost + np.minimum(prev[:, lo:hi], prev[:, lo + 1:hi + 1])
+            ## horizontal moves chain along the row: with C the running sum of
+            ## cost, cur[j] = min over k <= j of a[k] + C[j] - C[k]
+            C = np.cumsum(cost, 1)
+            cur = np.full_like(prev, np.inf)
+            cur[:, lo + 1:hi + 1] = C + np.minimum.accumulate(a - C, 1)
+
+            keep = cur[:, lo + 1:hi + 1].min(1) < best
+            if not keep.all():
+                self.stats['abandoned'] += int((~keep).sum())
+                alive, T, cur = alive[keep], T[keep], cur[keep]
+                if not len(alive):
+                    return out
+            prev = cur
+
+        out[alive] = prev[:, n]
+        self.stats['full'] += len(alive)
+        return out
+
+    def classify(self, series):
+        '''Returns (label, distance) of the template nearest to series.'''
+        if self.templates is None:
+            self.fit()
+        q = resample(series, self.length).astype(np.float32)
+        self.stats['queries'] += 1
+
+        ## the chunk with the smallest LB_Kim gives a first upper bound on the
+        ## distance, then the cascade prunes everything else
+        kim = self.lb_kim(q)
+        order = np.argsort(kim)
+        inds = order[:self.chunk]
+        d = self.dtw(q, inds)
+        k = d.argmin()
+        best, best_ind = d[k], inds[k]
+
+        ## the others go by blocks of increasing LB_Kim, so that LB_Keogh is
+        ## only computed until LB_Kim alone prunes everything left
+        for b in range(self.chunk, len(order), self.block):
+            rest = order[b:b + self.block]
+            if kim[rest[0]] >= best:
+                self.stats['kim'] += len(order) - b
+                break
+            keep = kim[rest] < best
+            self.stats['kim'] += int((~keep).sum())
+            rest = rest[keep]
+            lb = self.lb_keogh(q, rest)
+            keep = lb < best
+            self.stats['keogh'] += int((~keep).sum())
+            rest, lb = rest[keep], lb[keep]
+            rest, lb = rest[np.argsort(lb)], np.sort(lb)
+
+            ## visiting candidates by increasing bound lowers best quickly
+            for s in range(0, len(rest), self.chunk):
+                if lb[s] >= best:
+                    self.stats['keogh'] += len(rest) - s
+                    break
+                inds = rest[s:s + self.chunk]
+                inds = inds[lb[s:s + self.chunk] < best]
+                d = self.dtw(q, inds, best)
+                k = d.argmin()
+                if d[k] < best:
+                    best, best_ind = d[k], inds[k]
+
+        return int(self.labels[best_ind]), float(best)
+
+    def classify_many(self, series_list, processes=None):
+        '''Classifies several gestures in parallel worker processes.'''
+        if self.templates is None:
+            self.fit()
+        if processes == 1 or len(series_list) < 2:
+            return [self.classify(s) for s in series_list]
+        pool = multiprocessing.Pool(processes, _init_worker, (self,))
+        try:
+            res = pool.map(_classify_worker, series_list)
+        finally:
+            pool.close()
+            pool.join()
+        for _, stats in res:
+            for k, v in stats.items():
+                self.stats[k] += v
+        return [r for r, _ in res]
+
+    def classify_recording(self, recording, processes=None):
+        return self.classify_many([gesture_to_array(g, self.fields)
+                                   for g in recording.gestures], processes)
+
+
+## workers get the classifier once, instead of once per gesture
+_worker_cls = None
+
+def _init_worker(cls):
+    global _worker_cls
+    _worker_cls = cls
+
+def _classify_worker(series):
+    '''Returns the classification of series, and what it added to the
+    worker's stats, which the caller sums.'''
+    stats = dict(_worker_cls.stats)
+    res = _worker_cls.classify(series)
+    return res, dict((k, v - stats[k]) for k, v in _worker_cls.stats.items())
+
+
+class StrokeDetector(object):
+    '''Cuts strokes out of a MyoRaw's live readings and classifies each with
+    a DTWClassifier, calling the stroke handlers with (label, distance).
+
+    The activity is the mean of the 8 EMG channels over the last `smooth`
+    readings. A stroke starts when it exceeds `start` times its level at rest
+    (a slow average of the activity between strokes), and ends once it has
+    stayed below `stop` times that level for `hold` readings; strokes shorter
+    than `min_len` readings are ignored, and longer than `max_len` cut off.
+    A gap in the data drops the stroke in progress.'''
+
+    def __init__(self, cls, start=3., stop=1.5, smooth=5, hold=10,
+                 min_len=10, max_len=200, rest_rate=0.01):
+        self.cls = cls
+        self.start = start
+        self.stop = stop
+        self.smooth = smooth
+        self.hold = hold
+        self.min_len = min_len
+        self.max_len = max_len
+        self.rest_rate = rest_rate
+        self.handlers = []
+
+        self.rest = None
+        self.recent = []
+        self.imu = {'quat': (0,) * 4, 'acc': (0,) * 3, 'gyro': (0,) * 3}
+        self.stroke = None
+        self.quiet = 0
+
+    def add_handler(self, h):
+        self.handlers.append(h)
+
+    def on_imu(self, quat, acc, gyro):
+        self.imu['quat'], self.imu['acc'], self.imu['gyro'] = quat, acc, gyro
+
+    def on_gap(self, t_lost, t_back):
+        self.stroke = None
+        self.recent = []
+
+    def on_emg(self, emg, moving):
+        self.recent.append(sum(emg) / 8.)
+        if len(self.recent) > self.smooth:
+            del self.recent[0]
+        activity = sum(self.recent) / len(self.recent)
+
+        if self.stroke is None:
+            if self.rest is None:
+                self.rest = activity
+                return
+            if activity > self.start * max(self.rest, 1.):
+                self.stroke = []
+                self.quiet = 0
+            else:
+                self.rest += self.rest_rate * (activity - self.rest)
+                return
+
+        self.imu['emg'] = emg
+        self.stroke.append(sum((tuple(self.imu[f]) for f in self.cls.fields), ()))
+        self.quiet = self.quiet + 1 if activity < self.stop * max(self.rest, 1.) else 0
+        if self.quiet >= self.hold or len(self.stroke) >= self.max_len:
+            stroke = self.stroke[:len(self.stroke) - self.quiet]
+            self.stroke = None
+            if len(stroke) >= self.min_len:
+                self.on_stroke(*self.cls.classify(stroke))
+
+    def on_stroke(self, label, distance):
+        for h in self.handlers:
+            h(label, distance)
+
+    def attach(self, m):
+        m.add_emg_handler(self.on_emg)
+        m.add_imu_handler(self.on_imu)
+        m.add_gap_handler(self.on_gap)
+
+
+if __name__ == '__main__':
+    ## usage, from the repository root (or with myoraw installed):
+    ##   python -m myoraw.dtw RECORDING... -- RECORDING...
+    ## templates are loaded from the files before '--', and the gestures in
+    ## the files after it are classified against them.
+    if '--' not in sys.argv[1:]:
+        print('usage: python -m myoraw.dtw RECORDING... -- RECORDING...')
+        sys.exit(1)
+    sep = sys.argv.index('--')
+    cls = DTWClassifier()
+    cls.load(sys.argv[1:sep])
+    print('%d templates' % len(cls.labels))
+
+    for path in sys.argv[sep + 1:]:
+        with open(path, 'rb') as f:
+            rec = Recording.unpack_from_file(f)
+        t0 = time.time()
+        res = cls.classify_recording(rec)
+        dt = time.time() - t0
+        ok = sum(1 for y, _ in res if y == rec.file_header.gesture_type)
+        print('%s: %d/%d correct, %.2f ms/gesture' % (path, ok, len(res), 1000 * dt / len(res)))
+    print(cls.stats)
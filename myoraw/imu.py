@@ -0,0 +1,144 @@
+from __future__ import print_function
+
+import numpy as np
+
+## raw units per unit: quaternion (unit norm), accelerometer (g), gyroscope
+## (deg/s)
+ORIENTATION_SCALE = 16384.
+ACCELEROMETER_SCALE = 2048.
+GYROSCOPE_SCALE = 16.
+GRAVITY = 9.80665
+## rate of the IMU data, as set by MyoRaw.IMU_HZ
+IMU_HZ = 50
+## number of samples MotionEngine.on_imu gathers before processing them
+BATCH = 8
+
+
+## Every function works on whole batches: quaternions are (n, 4) arrays in
+## (w, x, y, z) order and vectors (n, 3) arrays. Everything is computed one
+## sample at a time component by component, so that a sample's result never
+## depends on the size of the batch it came in.
+
+def normalize(q):
+    q = np.asarray(q, dtype=np.float64)
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    n = np.sqrt(w * w + x * x + y * y + z * z)[:, None]
+    ## an all-zero quaternion (no data yet) becomes the identity
+    return np.where(n > 0, q / np.where(n > 0, n, 1), [1., 0., 0., 0.])
+
+def conjugate(q):
+    return q * np.array([1., -1., -1., -1.])
+
+def multiply(a, b):
+    '''Hamilton product of two batches of quaternions (or of a batch and a
+    single quaternion, broadcast).'''
+    a = np.atleast_2d(a)
+    b = np.atleast_2d(b)
+    aw, ax, ay, az = a[:, 0], a[:, 1], a[:, 2], a[:, 3]
+    bw, bx, by, bz = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    return np.stack([aw * bw - ax * bx - ay * by - az * bz,
+                     aw * bx + ax * bw + ay * bz - az * by,
+                     aw * by - ax * bz + ay * bw + az * bx,
+                     aw * bz + ax * by - ay * bx + az * bw], 1)
+
+def cross(a, b):
+    ax, ay, az = a[:, 0], a[:, 1], a[:, 2]
+    bx, by, bz = b[:, 0], b[:, 1], b[:, 2]
+    return np.stack([ay * bz - az * by, az * bx - ax * bz, ax * by - ay * bx], 1)
+
+def rotate(q, v):
+    '''Rotates the vectors v by the unit quaternions q.'''
+    u = q[:, 1:]
+    t = 2 * cross(u, v)
+    return v + q[:, :1] * t + cross(u, t)
+
+def euler(q):
+    '''Returns the (roll, pitch, yaw) angles of unit quaternions, in
+    radians.'''
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    roll = np.arctan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+    pitch = np.arcsin(np.clip(2 * (w * y - z * x), -1, 1))
+    yaw = np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+    return np.stack([roll, pitch, yaw], 1)
+
+def to_units(quat, acc, gyro):
+    '''Converts raw readings to a unit quaternion, acceleration in g and
+    angular velocity in rad/s.'''
+    q = normalize(np.asarray(quat, dtype=np.float64) / ORIENTATION_SCALE)
+    a = np.asarray(acc, dtype=np.float64) / ACCELEROMETER_SCALE
+    g = np.radians(np.asarray(gyro, dtype=np.float64) / GYROSCOPE_SCALE)
+    return q, a, g
+
+def linear_acceleration(q, acc):
+    '''Acceleration in the world frame (z up) without gravity, in m/s^2, from
+    orientations and accelerometer readings in g.'''
+    a = rotate(q, acc)
+    a[:, 2] -= 1
+    return a * GRAVITY
+
+
+class MotionEngine(object):
+    '''Turns raw IMU readings into orientation and motion features, over a
+    stroke: process() takes any number of samples at a time, and gives the
+    same results whether a stroke is processed whole or in pieces (reset()
+    starts a new stroke).
+
+    The results are a dict of arrays with one row per sample:
+    quat      orientation, as a unit quaternion
+    euler     orientation, as (roll, pitch, yaw) in radians
+    rel_quat  orientation relative to the first sample of the stroke
+    rel_euler the same, as Euler angles
+    acc       acceleration in the world frame without gravity, in m/s^2
+    gyro      angular velocity, in rad/s
+    angle     angular velocity integrated since the start of the stroke, in
+              radians around each of the sensor's axes'''
+
+    def __init__(self, hz=IMU_HZ):
+        self.dt = 1. / hz
+        self.handlers = []
+        self.pending = []
+        self.reset()
+
+    def reset(self):
+        ## samples received through on_imu belong to the previous stroke
+        self.flush()
+        self.q0_inv = None
+        self.angle = np.zeros(3)
+
+    def process(self, quat, acc, gyro):
+        q, a, g = to_units(np.reshape(quat, (-1, 4)), np.reshape(acc, (-1, 3)),
+                           np.reshape(gyro, (-1, 3)))
+        if self.q0_inv is None and len(q):
+            self.q0_inv = conjugate(q[:1])
+        rel = multiply(self.q0_inv, q) if len(q) else q
+
+        ## cumulative sums are sequential, so starting this batch's from the
+        ## last total gives exactly the sums of the whole stroke
+        angle = np.cumsum(np.vstack([self.angle, g * self.dt]), 0)[1:]
+        if len(angle): self.angle = angle[-1]
+
+        return dict(quat=q, euler=euler(q), rel_quat=rel, rel_euler=euler(rel),
+                    acc=linear_acceleration(q, a), gyro=g, angle=angle)
+
+    ## streaming from a MyoRaw
+
+    def add_handler(self, h):
+        '''h(results) is called with the results of every batch of samples
+        received through on_imu.'''
+        self.handlers.append(h)
+
+    def on_imu(self, quat, acc, gyro):
+        self.pending.append(quat + acc + gyro)
+        if len(self.pending) >= BATCH:
+            self.flush()
+
+    def flush(self):
+        if not self.pending: return
+        v = np.array(self.pending)
+        self.pending = []
+        res = self.process(v[:, :4], v[:, 4:7], v[:, 7:])
+        for h in self.handlers:
+            h(res)
+
+    def attach(self, m):
+        m.add_imu_handler(self.on_imu)
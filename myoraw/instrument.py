@@ -0,0 +1,148 @@
+from __future__ import print_function
+
+import sys
+import threading
+import time
+
+## histograms are log-linear over microseconds: exact below 2 * SUB, then SUB
+## buckets per power of two (about 3% resolution)
+SUB = 32
+BUCKETS = SUB * 40
+
+
+def _bucket(us):
+    if us < 2 * SUB:
+        return us
+    s = us.bit_length() - SUB.bit_length()
+    return s * SUB + (us >> s)
+
+def _value(i):
+    '''Lowest value (in us) that falls in bucket i.'''
+    if i < 2 * SUB:
+        return i
+    s = i // SUB - 1
+    return (i - s * SUB) << s
+
+
+class Histogram(object):
+    '''HDR-style latency histogram. Updates are a single list increment and
+    take no lock: each histogram is meant to be written by one thread, and
+    readers only ever see slightly stale counts.'''
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.n = 0
+        self.total = 0.
+        self.max = 0.
+
+    def record(self, dt):
+        us = int(dt * 1e6)
+        self.counts[min(_bucket(us), BUCKETS - 1)] += 1
+        self.n += 1
+        self.total += dt
+        if dt > self.max: self.max = dt
+
+    def percentile(self, p):
+        '''Returns the p-th percentile, in seconds.'''
+        if not self.n: return 0.
+        target = self.n * p / 100.
+        acc = 0
+        for i, c in enumerate(list(self.counts)):
+            acc += c
+            if acc >= target:
+                return _value(i) * 1e-6
+        return self.max
+
+    def summary(self):
+        return dict(n=self.n,
+                    mean=self.total / self.n if self.n else 0.,
+                    p50=self.percentile(50), p90=self.percentile(90),
+                    p99=self.percentile(99), max=self.max)
+
+
+class Stats(object):
+    '''Registry of latency histograms, event counters and gauges (e.g. queue
+    depths), by name. Everything is a no-op until enable() is called, so the
+    instrumented code only pays for a test of self.enabled.'''
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.hists = {}
+        self.counters = {}
+        self.gauges = {}
+        self.t0 = time.time()
+        self._last = (self.t0, {})
+
+    def enable(self, on=True):
+        self.enabled = on
+
+    def record(self, name, dt):
+        h = self.hists.get(name)
+        if h is None:
+            h = self.hists[name] = Histogram()
+        h.record(dt)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, v):
+        '''Records the current value of name, keeping track of its maximum.'''
+        cur, mx = self.gauges.get(name, (0, v))
+        self.gauges[name] = (v, max(mx, v))
+
+    def snapshot(self):
+        '''Returns a dict of everything recorded so far. Counter rates are
+        per second since the previous snapshot.'''
+        now = time.time()
+        t, last = self._last
+        counters = dict(self.counters)
+        self._last = (now, counters)
+        return dict(
+            uptime=now - self.t0,
+            latency=dict((k, h.summary()) for k, h in list(self.hists.items())),
+            counters=dict((k, dict(total=v, rate=(v - last.get(k, 0)) / max(now - t, 1e-9)))
+                          for k, v in counters.items()),
+            gauges=dict((k, dict(cur=v, max=mx)) for k, (v, mx) in list(self.gauges.items())),
+        )
+
+    def dump(self, out=sys.stderr):
+        s = self.snapshot()
+        print('--- stats after %.1f s' % s['uptime'], file=out)
+        for k, v in sorted(s['counters'].items()):
+            print('%-28s %10d  %8.1f/s' % (k, v['total'], v['rate']), file=out)
+        for k, v in sorted(s['gauges'].items()):
+            print('%-28s %10d  max %d' % (k, v['cur'], v['max']), file=out)
+        for k, v in sorted(s['latency'].items()):
+            print('%-28s %10d  mean %7.0f us  p50 %7.0f  p99 %7.0f  max %7.0f' %
+                  (k, v['n'], v['mean'] * 1e6, v['p50'] * 1e6, v['p99'] * 1e6, v['max'] * 1e6),
+                  file=out)
+
+    def start_dump(self, interval=5., out=sys.stderr):
+        '''Enables recording and dumps the stats every interval seconds from a
+        daemon thread.'''
+        self.enable()
+        def loop():
+            while self.enabled:
+                time.sleep(interval)
+                self.dump(out)
+        th = threading.Thread(target=loop)
+        th.daemon = True
+        th.start()
+        return th
+
+
+## the instance every module records into
+stats = Stats()
+
+def handler_name(h):
+    return getattr(h, '__name__', type(h).__name__)
+
+def timed_calls(prefix, handlers, *args):
+    '''Calls every handler with args, recording the time each one takes.'''
+    for h in handlers:
+        t0 = time.perf_counter()
+        h(*args)
+        stats.record('%s %s' % (prefix, handler_name(h)), time.perf_counter() - t0)
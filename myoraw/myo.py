@@ -1,98 +1,202 @@
 from __future__ import print_function
 
 from collections import Counter, deque
+import importlib.util
+import os
 import sys
 import time
+from time import perf_counter
 
 import numpy as np
 
-try:
-    from sklearn import neighbors, svm
-    HAVE_SK = True
-except ImportError:
-    HAVE_SK = False
+## sklearn takes longer to import than everything else together, so it is
+## only looked for here and imported by the first fit
+HAVE_SK = importlib.util.find_spec('sklearn') is not None
 
-from common import *
-from myo_raw import MyoRaw
+from myoraw.common import *
+from myoraw.decision import EarlyDecision
+from myoraw.instrument import stats, timed_calls
+from myoraw.myo_raw import MyoRaw
 
 SUBSAMPLE = 3
 K = 15
+## seconds between refits of the kd-tree while new data is being stored
+REFIT_INTERVAL = 1.
 
 class NNClassifier(object):
     '''A wrapper for sklearn's nearest-neighbor classifier that stores
     training data in vals0, ..., vals9.dat.'''
 
-    def __init__(self):
+    ## only every subsample-th training sample goes into the kd-tree, and
+    ## classification is a vote of its k nearest neighbors
+    subsample = SUBSAMPLE
+    k = K
+    ## where the vals*.dat files are
+    directory = '.'
+
+    def __init__(self, directory='.'):
+        self.directory = directory
         for i in range(10):
-            with open('vals%d.dat' % i, 'ab') as f: pass
+            with open(self.path(i), 'ab') as f: pass
+        self.read_data()
+
+    @classmethod
+    def from_files(cls, directory='.'):
+        '''Returns a classifier trained on the vals*.dat files of directory
+        without creating the missing ones, e.g. to replay recordings.'''
+        self = cls.__new__(cls)
+        self.directory = directory
         self.read_data()
+        return self
+
+    def path(self, i):
+        return os.path.join(self.directory, 'vals%d.dat' % i)
+
+    @classmethod
+    def from_arrays(cls, X, Y, subsample=SUBSAMPLE, k=K):
+        '''Returns a classifier trained on X, Y without touching the vals*.dat
+        files, e.g. for evaluation.'''
+        self = cls.__new__(cls)
+        self.subsample = subsample
+        self.k = k
+        self.train(X, Y)
+        return self
 
     def store_data(self, cls, vals):
-        with open('vals%d.dat' % cls, 'ab') as f:
+        with open(self.path(cls), 'ab') as f:
             f.write(pack('8H', *vals))
 
-        self.train(np.vstack([self.X, vals]), np.hstack([self.Y, [cls]]))
+        ## append in place, growing the buffers geometrically, and leave the
+        ## refit to the next classification
+        n = self.X.shape[0]
+        if n == self._X.shape[0]:
+            self._X = np.resize(self._X, (2 * n + 64, 8))
+            self._Y = np.resize(self._Y, 2 * n + 64)
+        self._X[n] = vals
+        self._Y[n] = cls
+        self.X = self._X[:n + 1]
+        self.Y = self._Y[:n + 1]
+        self.counts[cls] += 1
+        self.dirty = True
 
     def read_data(self):
         X = []
         Y = []
         for i in range(10):
-            X.append(np.fromfile('vals%d.dat' % i, dtype=np.uint16).reshape((-1, 8)))
+            if os.path.exists(self.path(i)):
+                X.append(np.fromfile(self.path(i), dtype=np.uint16).reshape((-1, 8)))
+            else:
+                X.append(np.zeros((0, 8), dtype=np.uint16))
             Y.append(i + np.zeros(X[-1].shape[0]))
 
         self.train(np.vstack(X), np.hstack(Y))
 
     def train(self, X, Y):
-        self.X = X
-        self.Y = Y
-        if HAVE_SK and self.X.shape[0] >= K * SUBSAMPLE:
-            self.nn = neighbors.KNeighborsClassifier(n_neighbors=K, algorithm='kd_tree')
-            self.nn.fit(self.X[::SUBSAMPLE], self.Y[::SUBSAMPLE])
+        self._X = np.array(X, dtype=np.int32).reshape((-1, 8))
+        self._Y = np.array(Y, dtype=np.float64)
+        self.X = self._X
+        self.Y = self._Y
+        ## number of samples of each class
+        self.counts = np.bincount(self.Y.astype(int), minlength=10)
+        self.nn = None
+        self.fit()
+
+    def fit(self):
+        self.dirty = False
+        self.t_fit = time.time()
+        if HAVE_SK and self.X.shape[0] >= self.k * self.subsample:
+            from sklearn import neighbors
+            self.nn = neighbors.KNeighborsClassifier(n_neighbors=self.k, algorithm='kd_tree')
+            self.nn.fit(self.X[::self.subsample], self.Y[::self.subsample])
         else:
             self.nn = None
 
+    def refit(self):
+        '''Refits the kd-tree if data was stored since the last fit, at most
+        every REFIT_INTERVAL seconds once there is one.'''
+        if self.dirty and (self.nn is None or time.time() - self.t_fit >= REFIT_INTERVAL):
+            self.fit()
+
     def nearest(self, d):
         dists = ((self.X - d)**2).sum(1)
         ind = dists.argmin()
         return self.Y[ind]
 
     def classify(self, d):
-        if self.X.shape[0] < K * SUBSAMPLE: return 0
+        if self.X.shape[0] < self.k * self.subsample: return 0
         if not HAVE_SK: return self.nearest(d)
-        return int(self.nn.predict(d)[0])
+        self.refit()
+        return int(self.nn.predict([d])[0])
+
+    def classify_proba(self, d):
+        '''Returns a vector of the class probabilities for d, with at least
+        10 classes.'''
+        p = np.zeros(len(self.counts))
+        if self.X.shape[0] < self.k * self.subsample:
+            p[0] = 1
+        elif not HAVE_SK:
+            p[int(self.nearest(d))] = 1
+        else:
+            self.refit()
+            p[self.nn.classes_.astype(int)] = self.nn.predict_proba([d])[0]
+        return p
 
 
 class Myo(MyoRaw):
     '''Adds higher-level pose classification and handling onto MyoRaw.'''
 
+    ## length of the classification history kept for display; decisions are
+    ## made by self.decision
     HIST_LEN = 25
 
-    def __init__(self, cls, tty=None):
+    def __init__(self, cls, tty=None, decision=None):
         MyoRaw.__init__(self, tty)
         self.cls = cls
+        if decision is None:
+            ## as many classes as the classifier's probability vectors have
+            counts = getattr(cls, 'counts', None)
+            decision = EarlyDecision(len(counts) if counts is not None else 10)
+        self.decision = decision
 
         self.history = deque([0] * Myo.HIST_LEN, Myo.HIST_LEN)
         self.history_cnt = Counter(self.history)
         self.add_emg_handler(self.emg_handler)
+        self.add_gap_handler(self.gap_handler)
         self.last_pose = None
 
         self.pose_handlers = []
 
     def emg_handler(self, emg, moving):
-        y = self.cls.classify(emg)
+        t0 = perf_counter()
+        if hasattr(self.cls, 'classify_proba'):
+            p = self.cls.classify_proba(emg)
+            y = int(p.argmax())
+        else:
+            y = p = self.cls.classify(emg)
+        if stats.enabled: stats.record('myo.classify', perf_counter() - t0)
         self.history_cnt[self.history[0]] -= 1
         self.history_cnt[y] += 1
         self.history.append(y)
 
-        r, n = self.history_cnt.most_common(1)[0]
-        if self.last_pose is None or (n > self.history_cnt[self.last_pose] + 5 and n > Myo.HIST_LEN / 2):
+        r = self.decision.update(p)
+        if r is not None:
             self.on_raw_pose(r)
             self.last_pose = r
 
+    def gap_handler(self, t_lost, t_back):
+        ## evidence from before the gap says nothing about the current pose
+        self.decision.reset()
+
     def add_raw_pose_handler(self, h):
         self.pose_handlers.append(h)
 
     def on_raw_pose(self, pose):
+        if stats.enabled:
+            ## from the end of the packet that triggered the pose
+            stats.record('myo.pose_latency', perf_counter() - self.bt.t_packet)
+            stats.count('myo.poses')
+            timed_calls('pose', self.pose_handlers, pose)
+            return
         for h in self.pose_handlers:
             h(pose)
 
@@ -1,16 +1,22 @@
 from __future__ import print_function
 
+from collections import deque
+from concurrent.futures import Future
 import enum
+import json
+import os
 import re
 import struct
 import sys
 import threading
 import time
+from time import perf_counter
 
 import serial
 from serial.tools.list_ports import comports
 
 from myoraw.common import *
+from myoraw.instrument import stats, timed_calls
 
 def multichr(ords):
     if sys.version_info[0] >= 3:
@@ -44,6 +50,10 @@ class Pose(enum.Enum):
     UNKNOWN = 255
 
 
+class CommandTimeout(IOError):
+    pass
+
+
 class Packet(object):
     def __init__(self, ords):
         self.typ = ords[0]
@@ -58,12 +68,36 @@ class Packet(object):
 
 
 class BT(object):
-    '''Implements the non-Myo-specific details of the Bluetooth protocol.'''
+    '''Implements the non-Myo-specific details of the Bluetooth protocol.
+
+    Commands don't block: they return futures, resolved as their responses
+    and events come in through recv_packet, so several of them can be
+    outstanding at once. Use wait() to pump packets until some are done.'''
+
+    ## seconds before a blocking command gives up
+    TIMEOUT = 2.
+    ## attribute writes a connection may have in progress at once; the dongle
+    ## only runs one GATT procedure per connection
+    MAX_PROCEDURES = 1
+
     def __init__(self, tty):
-        self.ser = serial.Serial(port=tty, baudrate=9600, dsrdtr=1)
+        ## tty can also be a pySerial URL, e.g. 'loop://' to run without a dongle
+        self.ser = serial.serial_for_url(tty, baudrate=9600, dsrdtr=1)
         self.buf = []
         self.lock = threading.Lock()
         self.handlers = []
+        ## when the last packet was completed, if stats are enabled
+        self.t_packet = 0
+
+        ## (cls, cmd, future) of the commands sent, in order: the dongle
+        ## answers them in the same order
+        self.responses = deque()
+        ## (cls, cmd) -> list of (connection or None, match or None, future)
+        ## waiting for that event
+        self.waiters = {}
+        ## per connection: writes not sent yet, and procedures in progress
+        self.write_queues = {}
+        self.procedures = {}
 
     ## internal data-handling methods
     def recv_packet(self, timeout=None):
@@ -76,8 +110,14 @@ class BT(object):
 
             ret = self.proc_byte(ord(c))
             if ret:
+                if stats.enabled:
+                    self.t_packet = perf_counter()
+                    stats.count('bt.packets')
+                    stats.gauge('bt.serial_queue', self.ser.in_waiting)
                 if ret.typ == 0x80:
                     self.handle_event(ret)
+                else:
+                    self.handle_response(ret)
                 return ret
 
     def recv_packets(self, timeout=.5):
@@ -107,7 +147,30 @@ class BT(object):
             return p
         return None
 
+    def handle_response(self, p):
+        while self.responses:
+            cls, cmd, f = self.responses.popleft()
+            if (cls, cmd) == (p.cls, p.cmd):
+                if not f.cancelled(): f.set_result(p)
+                return
+            ## a response never came for that one
+            if not f.cancelled(): f.set_exception(IOError('no response to %02X/%02X' % (cls, cmd)))
+
     def handle_event(self, p):
+        waiters = self.waiters.get((p.cls, p.cmd))
+        if waiters:
+            waiters[:] = [w for w in waiters if not w[2].cancelled()]
+            conn = list(multiord(p.payload[:1]))
+            for i, (c, match, f) in enumerate(waiters):
+                if (c is None or [c] == conn) and (match is None or match(p)):
+                    ## an event someone waited for is theirs alone
+                    del waiters[i]
+                    f.set_result(p)
+                    return
+
+        if stats.enabled:
+            timed_calls('bt.event', self.handlers, p)
+            return
         for h in self.handlers:
             h(p)
 
@@ -118,16 +181,32 @@ class BT(object):
         try: self.handlers.remove(h)
         except ValueError: pass
 
-    def wait_event(self, cls, cmd):
-        res = [None]
-        def h(p):
-            if p.cls == cls and p.cmd == cmd:
-                res[0] = p
-        self.add_handler(h)
-        while res[0] is None:
-            self.recv_packet()
-        self.remove_handler(h)
-        return res[0]
+    def expect_event(self, cls, cmd, conn=None, match=None):
+        '''Returns a future for the next (cls, cmd) event, on the given
+        connection if not None, for which match(packet) is true if given;
+        the events it doesn't take go to the handlers.'''
+        f = Future()
+        self.waiters.setdefault((cls, cmd), []).append((conn, match, f))
+        return f
+
+    def wait_event(self, cls, cmd, timeout=TIMEOUT):
+        return self.wait(self.expect_event(cls, cmd), timeout)
+
+    def wait(self, futures, timeout=TIMEOUT):
+        '''Receives packets until the given future (or list of futures) is
+        done, and returns its result (or the list of their results). On
+        timeout, the futures left are cancelled and CommandTimeout raised.'''
+        single = isinstance(futures, Future)
+        if single: futures = [futures]
+        t0 = time.time()
+        while not all(f.done() for f in futures):
+            left = None if timeout is None else t0 + timeout - time.time()
+            if left is not None and left <= 0:
+                for f in futures: f.cancel()
+                raise CommandTimeout('timed out waiting for the dongle')
+            self.recv_packet(left)
+        res = [f.result() for f in futures]
+        return res[0] if single else res
 
     ## specific BLE commands
     def connect(self, addr):
@@ -145,32 +224,138 @@ class BT(object):
     def disconnect(self, h):
         return self.send_command(3, 0, pack('B', h))
 
-    def read_attr(self, con, attr):
-        self.send_command(4, 4, pack('BH', con, attr))
-        return self.wait_event(4, 5)
+    def read_attr(self, con, attr, timeout=TIMEOUT):
+        ## notifications are (4, 5) events too, and may come in meanwhile
+        handle = pack('H', attr)
+        value = self.expect_event(4, 5, con, lambda p: p.payload[1:3] == handle)
+        self.send_command_async(4, 4, pack('BH', con, attr))
+        return self.wait(value, timeout)
+
+    def write_attr(self, con, attr, val, timeout=TIMEOUT):
+        return self.wait(self.write_attr_async(con, attr, val), timeout)
+
+    def write_attrs(self, con, writes, timeout=TIMEOUT):
+        '''Performs a list of (attr, val) writes, in order, and waits for all
+        of them.'''
+        return self.wait([self.write_attr_async(con, attr, val) for attr, val in writes],
+                         timeout)
+
+    def write_attr_async(self, con, attr, val):
+        '''Queues an attribute write. The returned future gets the procedure
+        completed event; queued writes are sent as soon as the connection can
+        take them, as packets come in, without waiting for the caller.'''
+        f = Future()
+        self.write_queues.setdefault(con, deque()).append((attr, val, f))
+        self._next_write(con)
+        return f
+
+    def _next_write(self, con):
+        queue = self.write_queues.get(con)
+        while queue and self.procedures.get(con, 0) < self.MAX_PROCEDURES:
+            attr, val, f = queue.popleft()
+            if f.cancelled(): continue
+            self.procedures[con] = self.procedures.get(con, 0) + 1
+
+            done = self.expect_event(4, 1, con)
+            rsp = self.send_command_async(4, 5, pack('BHB', con, attr, len(val)) + val)
+            rsp.add_done_callback(lambda r, f=f, done=done: self._write_started(r, f, done))
+            done.add_done_callback(lambda d, con=con, f=f: self._write_done(con, f, d))
+            f.add_done_callback(lambda f, done=done: f.cancelled() and done.cancel())
+
+    def _write_started(self, rsp, f, done):
+        err = rsp.exception()
+        if err is None:
+            _, result = unpack('BH', rsp.result().payload[:3])
+            if not result: return
+            err = IOError('attribute write refused: %04X' % result)
+        ## the procedure didn't start, so won't complete
+        if not f.done(): f.set_exception(err)
+        done.cancel()
+
+    def _write_done(self, con, f, done):
+        self.procedures[con] -= 1
+        if not done.cancelled() and not f.done():
+            p = done.result()
+            _, result, _ = unpack('BHH', p.payload[:5])
+            if result:
+                f.set_exception(IOError('attribute write failed: %04X' % result))
+            else:
+                f.set_result(p)
+        self._next_write(con)
 
-    def write_attr(self, con, attr, val):
-        self.send_command(4, 5, pack('BHB', con, attr, len(val)) + val)
-        return self.wait_event(4, 1)
+    def send_command_async(self, cls, cmd, payload=b''):
+        '''Sends a command; the returned future gets its response.'''
+        f = Future()
+        self.responses.append((cls, cmd, f))
+        self.ser.write(pack('4B', 0, len(payload), cls, cmd) + payload)
+        return f
 
-    def send_command(self, cls, cmd, payload=b'', wait_resp=True):
-        s = pack('4B', 0, len(payload), cls, cmd) + payload
-        self.ser.write(s)
+    def send_command(self, cls, cmd, payload=b'', timeout=TIMEOUT):
+        return self.wait(self.send_command_async(cls, cmd, payload), timeout)
 
-        while True:
-            p = self.recv_packet()
 
-            ## no timeout, so p won't be None
-            if p.typ == 0: return p
+MYO_UUID_SUFFIX = b'\x06\x42\x48\x12\x4A\x7F\x2C\x48\x47\xB9\xDE\x04\xA9\x01\x00\x06\xD5'
+
+DEVICE_CACHE = os.path.join(os.path.expanduser('~'), '.myosport', 'devices.json')
+
+
+class DeviceCache(object):
+    '''Remembers the addresses and firmware versions of the Myos we connected
+    to, so that the next connection doesn't need a scan.'''
+
+    def __init__(self, path=DEVICE_CACHE):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.devices = json.load(f)
+        except (IOError, ValueError):
+            self.devices = {}
+
+    @staticmethod
+    def key(addr):
+        return ':'.join('%02X' % b for b in addr)
+
+    def addresses(self):
+        '''Known addresses, most recently used first.'''
+        keys = sorted(self.devices, key=lambda k: -self.devices[k]['last_seen'])
+        return [[int(b, 16) for b in k.split(':')] for k in keys]
 
-            ## not a response: must be an event
-            self.handle_event(p)
+    def firmware(self, addr):
+        d = self.devices.get(self.key(addr))
+        return tuple(d['firmware']) if d and d.get('firmware') else None
+
+    def update(self, addr, firmware):
+        self.devices[self.key(addr)] = dict(firmware=list(firmware), last_seen=time.time())
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(self.path, 'w') as f:
+                json.dump(self.devices, f, indent=1)
+        except (IOError, OSError) as e:
+            print('could not save device cache:', e)
 
 
 class MyoRaw(object):
     '''Implements the Myo-specific communication protocol.'''
 
-    def __init__(self, tty=None):
+    ## seconds to wait for a connection to be established
+    CONNECT_TIMEOUT = 10.
+    ## the same, when trying an address from the cache before scanning
+    CACHED_CONNECT_TIMEOUT = 2.
+    ## seconds to scan for a Myo before giving up
+    SCAN_TIMEOUT = 10.
+    ## without any data for this long, the link is considered lost
+    LINK_TIMEOUT = 2.
+    ## delays between reconnection attempts grow from the first to the second
+    RECONNECT_BACKOFF = (.5, 10.)
+
+    ## sensor settings sent to firmware v0 Myos (see connect())
+    EMG_RATE = 1000
+    EMG_HZ = 50
+    EMG_SMOOTH = 100
+    IMU_HZ = 50
+
+    def __init__(self, tty=None, cache=DEVICE_CACHE, auto_reconnect=True, any_known=False):
         if tty is None:
             tty = self.detect_tty()
         if tty is None:
@@ -178,10 +363,26 @@ class MyoRaw(object):
 
         self.bt = BT(tty)
         self.conn = None
+        self.addr = None
+        self.cache = DeviceCache(cache) if cache is not None else None
         self.emg_handlers = []
         self.imu_handlers = []
         self.arm_handlers = []
         self.pose_handlers = []
+        self.gap_handlers = []
+
+        self.auto_reconnect = auto_reconnect
+        ## whether connect() may try every known Myo, not only the last one:
+        ## where several are around, that may be another player's
+        self.any_known = any_known
+        ## when the link was lost, if it is, and when data was last received
+        ## (as of the last read that got some, flagged by handle_data)
+        self.t_lost = None
+        self.t_data = None
+        self.got_data = False
+        ## seconds each reconnection took, from the loss of the link
+        self.reconnect_times = []
+        self.bt.add_handler(self.handle_disconnect)
 
     def detect_tty(self):
         for p in comports():
@@ -192,64 +393,136 @@ class MyoRaw(object):
         return None
 
     def run(self, timeout=None):
-        self.bt.recv_packet(timeout)
+        '''Handles the next packet, waiting for it up to timeout seconds (or
+        forever); a link that stays silent for LINK_TIMEOUT meanwhile is
+        dropped. A lost link is reconnected first if auto_reconnect is set,
+        and otherwise only the dongle's packets are waited for.'''
+        if self.conn is None and self.t_lost is not None and self.auto_reconnect:
+            self.reconnect()
+            return
+        t_end = None if timeout is None else time.time() + timeout
+        while True:
+            ## the read is cut short when the link is due to time out
+            left = None if t_end is None else t_end - time.time()
+            if self.conn is not None and self.t_data is not None:
+                link_left = self.t_data + self.LINK_TIMEOUT - time.time()
+                left = link_left if left is None else min(left, link_left)
+            p = self.bt.recv_packet(max(left, 0) if left is not None else None)
+            if self.got_data:
+                self.got_data = False
+                self.t_data = time.time()
+
+            if self.conn is not None and self.t_data is not None and \
+               time.time() - self.t_data > self.LINK_TIMEOUT:
+                print('no data for %.1f s, dropping the link' % (time.time() - self.t_data))
+                conn = self.conn
+                self.lost(self.t_data)
+                try: self.bt.disconnect(conn)
+                except IOError: pass
+                return
+            if p is not None or (t_end is not None and time.time() >= t_end):
+                return
+
+    def scan(self, timeout=None, addr=None):
+        '''Returns the address of the first Myo found, or waits for the one
+        at addr if given.'''
+        if timeout is None: timeout = self.SCAN_TIMEOUT
+        print('scanning...')
+        t0 = time.time()
+        self.bt.discover()
+        try:
+            while True:
+                p = self.bt.wait(self.bt.expect_event(6, 0), t0 + timeout - time.time())
+                found = list(multiord(p.payload[2:8]))
+                if p.payload.endswith(MYO_UUID_SUFFIX) and addr in (None, found):
+                    return found
+        except CommandTimeout:
+            raise IOError('no Myo found after %g s of scanning' % timeout)
+        finally:
+            self.bt.end_scan()
+
+    def connect_to(self, addr, timeout=None):
+        if timeout is None: timeout = self.CONNECT_TIMEOUT
+        ## connect and wait for status event
+        status = self.bt.expect_event(3, 0)
+        conn_pkt = self.bt.connect(addr)
+        try:
+            self.bt.wait(status, timeout)
+        except CommandTimeout:
+            ## stop trying to connect
+            self.bt.end_scan()
+            raise
+        self.conn = multiord(conn_pkt.payload)[-1]
+        self.addr = addr
 
-    def connect(self):
+    def connect(self, addr=None):
+        '''Connects to the Myo at addr, or else to the last one connected to
+        (or every known one, most recent first, if any_known is set), or else
+        to the first one a scan finds. Addresses are tried directly first, and
+        only scanned for if they don't answer.'''
         ## stop everything from before
         self.bt.end_scan()
         self.bt.disconnect(0)
         self.bt.disconnect(1)
         self.bt.disconnect(2)
 
-        ## start scanning
-        print('scanning...')
-        self.bt.discover()
-        while True:
-            p = self.bt.recv_packet()
-            print('scan response:', p)
-
-            if p.payload.endswith(b'\x06\x42\x48\x12\x4A\x7F\x2C\x48\x47\xB9\xDE\x04\xA9\x01\x00\x06\xD5'):
-                addr = list(multiord(p.payload[2:8]))
+        if addr is not None:
+            candidates = [addr]
+        else:
+            candidates = [self.addr] if self.addr is not None else []
+            if self.cache is not None:
+                candidates += [a for a in self.cache.addresses() if a != self.addr]
+            if not self.any_known:
+                candidates = candidates[:1]
+
+        for a in candidates:
+            try:
+                self.connect_to(a, self.CACHED_CONNECT_TIMEOUT)
                 break
-        self.bt.end_scan()
-
-        ## connect and wait for status event
-        conn_pkt = self.bt.connect(addr)
-        self.conn = multiord(conn_pkt.payload)[-1]
-        self.bt.wait_event(3, 0)
-
-        ## get firmware version
-        fw = self.read_attr(0x17)
-        _, _, _, _, v0, v1, v2, v3 = unpack('BHBBHHHH', fw.payload)
+            except CommandTimeout:
+                print('%s not answering' % DeviceCache.key(a))
+        else:
+            self.connect_to(self.scan(addr=addr))
+        print('connected to %s' % DeviceCache.key(self.addr))
+
+        ## get firmware version, unless we know it already
+        fw = self.cache.firmware(self.addr) if self.cache is not None else None
+        if fw is None:
+            p = self.read_attr(0x17)
+            fw = unpack('BHBBHHHH', p.payload)[4:]
+            if self.cache is not None: self.cache.update(self.addr, fw)
+        v0, v1, v2, v3 = fw
         print('firmware version: %d.%d.%d.%d' % (v0, v1, v2, v3))
 
         self.old = (v0 == 0)
 
         if self.old:
-            ## don't know what these do; Myo Connect sends them, though we get data
-            ## fine without them
-            self.write_attr(0x19, b'\x01\x02\x00\x00')
-            self.write_attr(0x2f, b'\x01\x00')
-            self.write_attr(0x2c, b'\x01\x00')
-            self.write_attr(0x32, b'\x01\x00')
-            self.write_attr(0x35, b'\x01\x00')
-
-            ## enable EMG data
-            self.write_attr(0x28, b'\x01\x00')
-            ## enable IMU data
-            self.write_attr(0x1d, b'\x01\x00')
+            self.write_attrs([
+                ## don't know what these do; Myo Connect sends them, though we get
+                ## data fine without them
+                (0x19, b'\x01\x02\x00\x00'),
+                (0x2f, b'\x01\x00'),
+                (0x2c, b'\x01\x00'),
+                (0x32, b'\x01\x00'),
+                (0x35, b'\x01\x00'),
+
+                ## enable EMG data
+                (0x28, b'\x01\x00'),
+                ## enable IMU data
+                (0x1d, b'\x01\x00'),
+            ])
 
             ## Sampling rate of the underlying EMG sensor, capped to 1000. If it's
             ## less than 1000, emg_hz is correct. If it is greater, the actual
             ## framerate starts dropping inversely. Also, if this is much less than
             ## 1000, EMG data becomes slower to respond to changes. In conclusion,
             ## 1000 is probably a good value.
-            C = 1000
-            emg_hz = 50
+            C = self.EMG_RATE
+            emg_hz = self.EMG_HZ
             ## strength of low-pass filtering of EMG data
-            emg_smooth = 100
+            emg_smooth = self.EMG_SMOOTH
 
-            imu_hz = 50
+            imu_hz = self.IMU_HZ
 
             ## send sensor parameters, or we don't get any data
             self.write_attr(0x19, pack('BBBBHBBBBB', 2, 9, 2, 1, C, emg_smooth, C // emg_hz, imu_hz, 0, 0))
@@ -258,57 +531,104 @@ class MyoRaw(object):
             name = self.read_attr(0x03)
             print('device name: %s' % name.payload)
 
-            ## enable IMU data
-            self.write_attr(0x1d, b'\x01\x00')
-            ## enable on/off arm notifications
-            self.write_attr(0x24, b'\x02\x00')
+            self.write_attrs([
+                ## enable IMU data
+                (0x1d, b'\x01\x00'),
+                ## enable on/off arm notifications
+                (0x24, b'\x02\x00'),
+            ])
 
             # self.write_attr(0x19, b'\x01\x03\x00\x01\x01')
             self.start_raw()
 
-        ## add data handlers
-        def handle_data(p):
-            if (p.cls, p.cmd) != (4, 5): return
-
-            c, attr, typ = unpack('BHB', p.payload[:4])
-            pay = p.payload[5:]
-
-            if attr == 0x27:
-                vals = unpack('8HB', pay)
-                ## not entirely sure what the last byte is, but it's a bitmask that
-                ## seems to indicate which sensors think they're being moved around or
-                ## something
-                emg = vals[:8]
-                moving = vals[8]
-                self.on_emg(emg, moving)
-            elif attr == 0x1c:
-                vals = unpack('10h', pay)
-                quat = vals[:4]
-                acc = vals[4:7]
-                gyro = vals[7:10]
-                self.on_imu(quat, acc, gyro)
-            elif attr == 0x23:
-                typ, val, xdir = unpack('3B', pay)
-
-                # TODO(glourdel@student.42.fr): commented this section because
-                #     raised an exception when performing the sync gesture.
-
-                # if typ == 1: # on arm
-                #     self.on_arm(Arm(val), XDirection(xdir))
-                # elif typ == 2: # removed from arm
-                #     self.on_arm(Arm.UNKNOWN, XDirection.UNKNOWN)
-                # elif typ == 3: # pose
-                #     self.on_pose(Pose(val))
-            else:
-                print('data with unknown attr: %02X %s' % (attr, p))
-
-        self.bt.add_handler(handle_data)
+        if self.handle_data not in self.bt.handlers:
+            self.bt.add_handler(self.handle_data)
+        ## a Myo that never sends anything counts as silent from now on
+        self.t_data = time.time()
+        self.got_data = False
+
+    def handle_disconnect(self, p):
+        if (p.cls, p.cmd) != (3, 4) or self.conn is None: return
+        conn, reason = unpack('BH', p.payload[:3])
+        if conn == self.conn:
+            print('link lost (reason %04X)' % reason)
+            self.lost()
+
+    def lost(self, t=None):
+        '''Marks the link as lost since t (now by default); run() will then
+        reconnect if auto_reconnect is set.'''
+        self.conn = None
+        self.t_lost = time.time() if t is None else t
 
+    def reconnect(self, max_tries=None):
+        '''Reconnects to the last Myo, retrying with an exponential backoff,
+        then reports the gap in the data to the gap handlers.'''
+        delay, max_delay = self.RECONNECT_BACKOFF
+        tries = 0
+        while True:
+            try:
+                self.connect(self.addr)
+                break
+            except IOError as e:
+                tries += 1
+                if max_tries is not None and tries >= max_tries: raise
+                print('reconnection failed (%s), retrying in %.1f s' % (e, delay))
+                time.sleep(delay)
+                delay = min(2 * delay, max_delay)
+
+        t = time.time()
+        dt = t - self.t_lost
+        self.reconnect_times.append(dt)
+        if stats.enabled: stats.record('myo.reconnect', dt)
+        print('reconnected in %.2f s' % dt)
+        self.on_gap(self.t_lost, t)
+        self.t_lost = None
+
+    def handle_data(self, p):
+        if (p.cls, p.cmd) != (4, 5): return
+        self.got_data = True
+
+        c, attr, typ = unpack('BHB', p.payload[:4])
+        pay = p.payload[5:]
+
+        if attr == 0x27:
+            vals = unpack('8HB', pay)
+            ## not entirely sure what the last byte is, but it's a bitmask that
+            ## seems to indicate which sensors think they're being moved around or
+            ## something
+            emg = vals[:8]
+            moving = vals[8]
+            self.on_emg(emg, moving)
+        elif attr == 0x1c:
+            vals = unpack('10h', pay)
+            quat = vals[:4]
+            acc = vals[4:7]
+            gyro = vals[7:10]
+            self.on_imu(quat, acc, gyro)
+        elif attr == 0x23:
+            typ, val, xdir = unpack('3B', pay)
+
+            # TODO(glourdel@student.42.fr): commented this section because
+            #     raised an exception when performing the sync gesture.
+
+            # if typ == 1: # on arm
+            #     self.on_arm(Arm(val), XDirection(xdir))
+            # elif typ == 2: # removed from arm
+            #     self.on_arm(Arm.UNKNOWN, XDirection.UNKNOWN)
+            # elif typ == 3: # pose
+            #     self.on_pose(Pose(val))
+        else:
+            print('data with unknown attr: %02X %s' % (attr, p))
 
     def write_attr(self, attr, val):
         if self.conn is not None:
             self.bt.write_attr(self.conn, attr, val)
 
+    def write_attrs(self, writes):
+        '''Performs a list of (attr, val) writes, pipelined by BT.'''
+        if self.conn is not None:
+            self.bt.write_attrs(self.conn, writes)
+
     def read_attr(self, attr):
         if self.conn is not None:
             return self.bt.read_attr(self.conn, attr)
@@ -316,16 +636,20 @@ class MyoRaw(object):
 
     def disconnect(self):
         if self.conn is not None:
-            self.bt.disconnect(self.conn)
+            conn, self.conn = self.conn, None
+            self.t_lost = None
+            self.bt.disconnect(conn)
 
     def start_raw(self):
         '''Sending this sequence for v1.0 firmware seems to enable both raw data and
         pose notifications.
         '''
 
-        self.write_attr(0x28, b'\x01\x00')
-        self.write_attr(0x19, b'\x01\x03\x01\x01\x00')
-        self.write_attr(0x19, b'\x01\x03\x01\x01\x01')
+        self.write_attrs([
+            (0x28, b'\x01\x00'),
+            (0x19, b'\x01\x03\x01\x01\x00'),
+            (0x19, b'\x01\x03\x01\x01\x01'),
+        ])
 
     def mc_start_collection(self):
         '''Myo Connect sends this sequence (or a reordering) when starting data
@@ -333,18 +657,20 @@ class MyoRaw(object):
         pose notifications.
         '''
 
-        self.write_attr(0x28, b'\x01\x00')
-        self.write_attr(0x1d, b'\x01\x00')
-        self.write_attr(0x24, b'\x02\x00')
-        self.write_attr(0x19, b'\x01\x03\x01\x01\x01')
-        self.write_attr(0x28, b'\x01\x00')
-        self.write_attr(0x1d, b'\x01\x00')
-        self.write_attr(0x19, b'\x09\x01\x01\x00\x00')
-        self.write_attr(0x1d, b'\x01\x00')
-        self.write_attr(0x19, b'\x01\x03\x00\x01\x00')
-        self.write_attr(0x28, b'\x01\x00')
-        self.write_attr(0x1d, b'\x01\x00')
-        self.write_attr(0x19, b'\x01\x03\x01\x01\x00')
+        self.write_attrs([
+            (0x28, b'\x01\x00'),
+            (0x1d, b'\x01\x00'),
+            (0x24, b'\x02\x00'),
+            (0x19, b'\x01\x03\x01\x01\x01'),
+            (0x28, b'\x01\x00'),
+            (0x1d, b'\x01\x00'),
+            (0x19, b'\x09\x01\x01\x00\x00'),
+            (0x1d, b'\x01\x00'),
+            (0x19, b'\x01\x03\x00\x01\x00'),
+            (0x28, b'\x01\x00'),
+            (0x1d, b'\x01\x00'),
+            (0x19, b'\x01\x03\x01\x01\x00'),
+        ])
 
     def mc_end_collection(self):
         '''Myo Connect sends this sequence (or a reordering) when ending data collection
@@ -352,21 +678,23 @@ class MyoRaw(object):
         doesn't disable raw data.
         '''
 
-        self.write_attr(0x28, b'\x01\x00')
-        self.write_attr(0x1d, b'\x01\x00')
-        self.write_attr(0x24, b'\x02\x00')
-        self.write_attr(0x19, b'\x01\x03\x01\x01\x01')
-        self.write_attr(0x19, b'\x09\x01\x00\x00\x00')
-        self.write_attr(0x1d, b'\x01\x00')
-        self.write_attr(0x24, b'\x02\x00')
-        self.write_attr(0x19, b'\x01\x03\x00\x01\x01')
-        self.write_attr(0x28, b'\x01\x00')
-        self.write_attr(0x1d, b'\x01\x00')
-        self.write_attr(0x24, b'\x02\x00')
-        self.write_attr(0x19, b'\x01\x03\x01\x01\x01')
+        self.write_attrs([
+            (0x28, b'\x01\x00'),
+            (0x1d, b'\x01\x00'),
+            (0x24, b'\x02\x00'),
+            (0x19, b'\x01\x03\x01\x01\x01'),
+            (0x19, b'\x09\x01\x00\x00\x00'),
+            (0x1d, b'\x01\x00'),
+            (0x24, b'\x02\x00'),
+            (0x19, b'\x01\x03\x00\x01\x01'),
+            (0x28, b'\x01\x00'),
+            (0x1d, b'\x01\x00'),
+            (0x24, b'\x02\x00'),
+            (0x19, b'\x01\x03\x01\x01\x01'),
+        ])
 
     def vibrate(self, length):
-        if length in xrange(1, 4):
+        if length in range(1, 4):
             ## first byte tells it to vibrate; purpose of second byte is unknown
             self.write_attr(0x19, pack('3B', 3, 1, length))
 
@@ -383,12 +711,25 @@ class MyoRaw(object):
     def add_arm_handler(self, h):
         self.arm_handlers.append(h)
 
+    def add_gap_handler(self, h):
+        '''h(t_lost, t_back) is called after a reconnection, with the time
+        span during which no data could be received.'''
+        self.gap_handlers.append(h)
+
 
     def on_emg(self, emg, moving):
+        if stats.enabled:
+            stats.count('myo.emg')
+            timed_calls('emg', self.emg_handlers, emg, moving)
+            return
         for h in self.emg_handlers:
             h(emg, moving)
 
     def on_imu(self, quat, acc, gyro):
+        if stats.enabled:
+            stats.count('myo.imu')
+            timed_calls('imu', self.imu_handlers, quat, acc, gyro)
+            return
         for h in self.imu_handlers:
             h(quat, acc, gyro)
 
@@ -400,6 +741,10 @@ class MyoRaw(object):
         for h in self.arm_handlers:
             h(arm, xdir)
 
+    def on_gap(self, t_lost, t_back):
+        for h in self.gap_handlers:
+            h(t_lost, t_back)
+
 
 if __name__ == '__main__':
     try:
@@ -409,71 +754,38 @@ if __name__ == '__main__':
     except ImportError:
         HAVE_PYGAME = False
 
-    if HAVE_PYGAME:
-        w, h = 1200, 400
-        scr = pygame.display.set_mode((w, h))
-
-    last_vals = None
-    def plot(scr, vals):
-        DRAW_LINES = False
-
-        global last_vals
-        if last_vals is None:
-            last_vals = vals
-            return
-
-        D = 5
-        scr.scroll(-D)
-        scr.fill((0,0,0), (w - D, 0, w, h))
-        for i, (u, v) in enumerate(zip(last_vals, vals)):
-            if DRAW_LINES:
-                pygame.draw.line(scr, (0,255,0),
-                                 (w - D, int(h/8 * (i+1 - u))),
-                                 (w, int(h/8 * (i+1 - v))))
-                pygame.draw.line(scr, (255,255,255),
-                                 (w - D, int(h/8 * (i+1))),
-                                 (w, int(h/8 * (i+1))))
-            else:
-                c = int(255 * max(0, min(1, v)))
-                scr.fill((c, c, c), (w - D, i * h / 8, D, (i + 1) * h / 8 - i * h / 8));
-
-        pygame.display.flip()
-        last_vals = vals
-
     m = MyoRaw(sys.argv[1] if len(sys.argv) >= 2 else None)
-
-    def proc_emg(emg, moving, times=[]):
-        if HAVE_PYGAME:
-            ## update pygame display
-            plot(scr, [e / 2000. for e in emg])
-        else:
-            print(emg)
-
-        ## print framerate of received data
-        times.append(time.time())
-        if len(times) > 20:
-            #print((len(times) - 1) / (times[-1] - times[0]))
-            times.pop(0)
-
-    m.add_emg_handler(proc_emg)
     m.connect()
 
     m.add_arm_handler(lambda arm, xdir: print('arm', arm, 'xdir', xdir))
     m.add_pose_handler(lambda p: print('pose', p))
 
     try:
-        while True:
-            m.run(1)
-
-            if HAVE_PYGAME:
-                for ev in pygame.event.get():
-                    if ev.type == QUIT or (ev.type == KEYDOWN and ev.unicode == 'q'):
-                        raise KeyboardInterrupt()
-                    elif ev.type == KEYDOWN:
-                        if K_1 <= ev.key <= K_3:
-                            m.vibrate(ev.key - K_0)
-                        if K_KP1 <= ev.key <= K_KP3:
-                            m.vibrate(ev.key - K_KP0)
+        if HAVE_PYGAME:
+            from myoraw.visualizer import Visualizer
+
+            ## the display runs in this thread and the Myo in another; keys only
+            ## queue vibrations, which that other thread sends
+            vibrations = deque()
+            def on_key(ev):
+                if K_1 <= ev.key <= K_3:
+                    vibrations.append(ev.key - K_0)
+                if K_KP1 <= ev.key <= K_KP3:
+                    vibrations.append(ev.key - K_KP0)
+
+            def step():
+                m.run(.1)
+                while vibrations:
+                    m.vibrate(vibrations.popleft())
+
+            vis = Visualizer()
+            vis.attach(m, emg=True, imu=True)
+            vis.receive(step)
+            vis.run(on_key)
+        else:
+            m.add_emg_handler(lambda emg, moving: print(emg))
+            while True:
+                m.run(1)
 
     except KeyboardInterrupt:
         pass
@@ -0,0 +1,161 @@
+from __future__ import print_function
+
+import sys
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+## record kinds
+EMG = 1
+IMU = 2
+## no data could be received from t - vals[0] ms to t
+GAP = 3
+
+RECORD = np.dtype([
+    ('seq', '<u8'),
+    ('t', '<f8'),
+    ('kind', '<u4'),
+    ## EMG: 8 channels then the moving byte; IMU: quat, acc, gyro
+    ('vals', '<i4', 10),
+])
+
+## header slots, in uint64s
+_WRITE_SEQ = 0
+_CAPACITY = 1
+_HEADER = 8
+
+
+def _attach(name):
+    '''Attaches to an existing block without letting this process's resource
+    tracker destroy it when we exit: only the writer owns it.'''
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        ## Python < 3.13 always tracks, so keep it from registering the block
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name)
+        finally:
+            resource_tracker.register = register
+
+
+class RingWriter(object):
+    '''Single producer side of a shared-memory ring of EMG/IMU records.
+
+    Records carry increasing sequence numbers; the producer never waits for
+    readers, which detect on their own when they've been lapped.'''
+
+    def __init__(self, name=None, capacity=1 << 14):
+        size = _HEADER * 8 + capacity * RECORD.itemsize
+        self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        self.name = self.shm.name
+        self.header = np.ndarray(_HEADER, np.uint64, self.shm.buf)
+        self.records = np.ndarray(capacity, RECORD, self.shm.buf, _HEADER * 8)
+        self.capacity = capacity
+        self.header[:] = 0
+        self.header[_CAPACITY] = capacity
+        self.seq = 0
+
+    def write(self, kind, vals, t=None):
+        r = self.records[self.seq % self.capacity]
+        r['t'] = time.time() if t is None else t
+        r['kind'] = kind
+        r['vals'][:len(vals)] = vals
+        ## the record's seq is written last, and published after it, so that
+        ## readers never see a half-written record as current
+        r['seq'] = self.seq
+        self.seq += 1
+        self.header[_WRITE_SEQ] = self.seq
+
+    def on_emg(self, emg, moving):
+        self.write(EMG, emg + (moving,))
+
+    def on_imu(self, quat, acc, gyro):
+        self.write(IMU, quat + acc + gyro)
+
+    def on_gap(self, t_lost, t_back):
+        self.write(GAP, (int(1000 * (t_back - t_lost)),), t_back)
+
+    def attach(self, m):
+        '''Publishes everything a MyoRaw receives.'''
+        m.add_emg_handler(self.on_emg)
+        m.add_imu_handler(self.on_imu)
+        m.add_gap_handler(self.on_gap)
+
+    def close(self):
+        del self.header, self.records
+        self.shm.close()
+        self.shm.unlink()
+
+
+class RingReader(object):
+    '''Consumer side of a RingWriter's ring; any number of them can attach
+    from any process.'''
+
+    def __init__(self, name, from_start=False):
+        self.shm = _attach(name)
+        self.header = np.ndarray(_HEADER, np.uint64, self.shm.buf)
+        self.capacity = int(self.header[_CAPACITY])
+        self.records = np.ndarray(self.capacity, RECORD, self.shm.buf, _HEADER * 8)
+
+        ## next sequence number to read, and how many records were overwritten
+        ## before we got to them
+        self.seq = 0 if from_start else int(self.header[_WRITE_SEQ])
+        self.lost = 0
+        self._first = self.seq
+
+    def pending(self):
+        return int(self.header[_WRITE_SEQ]) - self.seq
+
+    def read(self, max_n=None):
+        '''Returns a view (not a copy) of the records written since the last
+        call, up to max_n of them and at most up to the end of the ring; the
+        rest is returned by the next call. The view is only guaranteed intact
+        while overrun() is False.'''
+        w = int(self.header[_WRITE_SEQ])
+        ## the oldest slot may already be in the middle of being rewritten
+        oldest = w - self.capacity + 1
+        if self.seq < oldest:
+            self.lost += oldest - self.seq
+            self.seq = oldest
+
+        n = w - self.seq
+        if max_n is not None: n = min(n, max_n)
+        i = self.seq % self.capacity
+        n = min(n, self.capacity - i)
+
+        self._first = self.seq
+        self.seq += n
+        return self.records[i:i + n]
+
+    def overrun(self):
+        '''True if the writer may have overwritten part of the last view
+        returned by read().'''
+        return int(self.header[_WRITE_SEQ]) - self._first >= self.capacity
+
+    def close(self):
+        del self.header, self.records
+        self.shm.close()
+
+
+if __name__ == '__main__':
+    ## publishes the data of the Myo on the given dongle (or the auto-detected
+    ## one) in a ring named 'myosport'; attach to it with RingReader('myosport')
+    from myoraw.myo_raw import MyoRaw
+
+    m = MyoRaw(sys.argv[1] if len(sys.argv) >= 2 else None)
+    ring = RingWriter('myosport')
+    ring.attach(m)
+    m.connect()
+
+    try:
+        while True:
+            m.run(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        m.disconnect()
+        ring.close()
+        print()
@@ -0,0 +1,356 @@
+from __future__ import print_function
+
+import errno
+import os
+import selectors
+import socket
+import stat
+import struct
+import sys
+import threading
+import time
+
+## frame types; a client may subscribe to a subset of them by sending a byte
+## whose bit (1 << type) is set for each type it wants
+FRAME_EMG = 1
+FRAME_IMU = 2
+FRAME_POSE = 3
+FRAME_STROKE = 4
+FRAME_GAP = 5
+ALL_FRAMES = 0xFF
+
+## every frame starts with: type, number of samples, payload length, time
+HEADER = struct.Struct('<BBHd')
+## payload of each sample/event, per frame type
+PAYLOADS = {
+    FRAME_EMG: struct.Struct('<8HB'),
+    FRAME_IMU: struct.Struct('<10h'),
+    FRAME_POSE: struct.Struct('<B'),
+    FRAME_STROKE: struct.Struct('<if'),
+    ## when the link was lost and when it came back
+    FRAME_GAP: struct.Struct('<dd'),
+}
+
+## a client whose unsent data exceeds this gets new frames dropped
+MAX_QUEUE = 1 << 16
+## number of EMG/IMU samples sent together
+BATCH = 8
+
+
+def frame(typ, samples, t=None):
+    '''Builds a frame from a list of tuples matching PAYLOADS[typ].'''
+    s = PAYLOADS[typ]
+    payload = b''.join(s.pack(*v) for v in samples)
+    return HEADER.pack(typ, len(samples), len(payload),
+                       time.time() if t is None else t) + payload
+
+def parse_frames(buf):
+    '''Decodes the complete frames at the start of buf. Returns the list of
+    (type, time, samples) and the number of bytes consumed.'''
+    res = []
+    pos = 0
+    while len(buf) - pos >= HEADER.size:
+        typ, n, size, t = HEADER.unpack_from(buf, pos)
+        end = pos + HEADER.size + size
+        if len(buf) < end: break
+        s = PAYLOADS.get(typ)
+        if s is None:
+            samples = [bytes(buf[pos + HEADER.size:end])]
+        else:
+            samples = [s.unpack_from(buf, pos + HEADER.size + i * s.size) for i in range(n)]
+        res.append((typ, t, samples))
+        pos = end
+    return res, pos
+
+def _family(address):
+    if isinstance(address, str):
+        return socket.AF_UNIX
+    return socket.AF_INET6 if ':' in address[0] else socket.AF_INET
+
+def _make_socket(address):
+    if not isinstance(address, str):
+        host = address[0]
+        if host not in ('localhost', '127.0.0.1', '::1'):
+            raise ValueError('refusing to serve on non-loopback address %s' % host)
+    return socket.socket(_family(address), socket.SOCK_STREAM)
+
+def _remove_stale_socket(path):
+    '''Removes the socket a server that is gone left at path. Anything else
+    there, a file or the socket of a running server, is left alone and
+    raises ValueError.'''
+    try:
+        mode = os.stat(path).st_mode
+    except OSError as e:
+        if e.errno == errno.ENOENT: return
+        raise
+    if not stat.S_ISSOCK(mode):
+        raise ValueError('%s exists and is not a socket' % path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError as e:
+        if e.errno != errno.ECONNREFUSED: raise
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise ValueError('%s: a server is already running there' % path)
+
+
+class _Client(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.out = bytearray()
+        self.mask = ALL_FRAMES
+        self.sent = 0
+        self.dropped = 0
+
+
+class StreamServer(object):
+    '''Serves frames to any number of local clients, over a Unix domain
+    socket (address is a path) or loopback TCP (address is (host, port)).
+
+    Nothing here ever blocks: poll() accepts clients and sends what each can
+    take, and a client too slow to keep up loses frames instead of holding
+    back the others or the device.'''
+
+    def __init__(self, address, max_queue=MAX_QUEUE):
+        self.address = address
+        self.max_queue = max_queue
+        self.sel = selectors.DefaultSelector()
+        self.clients = {}
+
+        self.sock = _make_socket(address)
+        if isinstance(address, str):
+            _remove_stale_socket(address)
+        else:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(address)
+        self.sock.listen(16)
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+        self.sel.register(self.sock, selectors.EVENT_READ)
+
+    def publish(self, data, typ):
+        for c in self.clients.values():
+            if not c.mask & (1 << typ): continue
+            if len(c.out) + len(data) > self.max_queue:
+                c.dropped += 1
+                continue
+            if not c.out:
+                self.sel.modify(c.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, c)
+            c.out += data
+
+    def poll(self, timeout=0):
+        for key, ev in self.sel.select(timeout):
+            if key.fileobj is self.sock:
+                self._accept()
+                continue
+            c = key.data
+            if ev & selectors.EVENT_READ:
+                self._recv(c)
+            if ev & selectors.EVENT_WRITE and c.sock in self.clients:
+                self._send(c)
+
+    def _accept(self):
+        try:
+            sock, _ = self.sock.accept()
+        except socket.error:
+            return
+        sock.setblocking(False)
+        c = _Client(sock)
+        self.clients[sock] = c
+        self.sel.register(sock, selectors.EVENT_READ, c)
+
+    def _recv(self, c):
+        try:
+            data = c.sock.recv(64)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK): return
+            data = b''
+        if not data:
+            self._drop(c)
+        else:
+            ## the last byte sent is the client's subscription mask
+            c.mask = bytearray(data)[-1]
+
+    def _send(self, c):
+        try:
+            n = c.sock.send(c.out)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK): return
+            self._drop(c)
+            return
+        del c.out[:n]
+        c.sent += n
+        if not c.out:
+            self.sel.modify(c.sock, selectors.EVENT_READ, c)
+
+    def _drop(self, c):
+        self.sel.unregister(c.sock)
+        del self.clients[c.sock]
+        c.sock.close()
+
+    def close(self):
+        for c in list(self.clients.values()):
+            self._drop(c)
+        self.sel.unregister(self.sock)
+        self.sock.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+class StreamDaemon(object):
+    '''Publishes the data of a MyoRaw (or Myo) through a StreamServer: raw
+    EMG/IMU readings in batches, and pose and stroke events as they happen.
+    Strokes come from strokes, e.g. a dtw.StrokeDetector attached to m.'''
+
+    def __init__(self, m, server, batch=BATCH, strokes=None):
+        self.m = m
+        self.server = server
+        self.batch = batch
+        self.emg = []
+        self.imu = []
+
+        m.add_emg_handler(self.on_emg)
+        m.add_imu_handler(self.on_imu)
+        m.add_gap_handler(self.on_gap)
+        if hasattr(m, 'add_raw_pose_handler'):
+            m.add_raw_pose_handler(self.on_pose)
+        if strokes is not None:
+            strokes.add_handler(self.on_stroke)
+
+    def on_emg(self, emg, moving):
+        self.emg.append(emg + (moving,))
+        if len(self.emg) >= self.batch:
+            self.flush()
+
+    def on_imu(self, quat, acc, gyro):
+        self.imu.append(quat + acc + gyro)
+        if len(self.imu) >= self.batch:
+            self.flush()
+
+    def on_pose(self, pose):
+        self.server.publish(frame(FRAME_POSE, [(pose,)]), FRAME_POSE)
+
+    def on_gap(self, t_lost, t_back):
+        ## samples from before the gap go out first
+        self.flush()
+        self.server.publish(frame(FRAME_GAP, [(t_lost, t_back)]), FRAME_GAP)
+
+    def on_stroke(self, label, distance):
+        '''Called with each stroke classification, e.g. by a StrokeDetector.'''
+        ## readings from before the stroke's end go out first
+        self.flush()
+        self.server.publish(frame(FRAME_STROKE, [(label, distance)]), FRAME_STROKE)
+
+    def flush(self):
+        if self.emg:
+            self.server.publish(frame(FRAME_EMG, self.emg), FRAME_EMG)
+            self.emg = []
+        if self.imu:
+            self.server.publish(frame(FRAME_IMU, self.imu), FRAME_IMU)
+            self.imu = []
+
+    def run(self, timeout=.01):
+        self.m.run(timeout)
+        self.server.poll(0)
+
+
+class StreamClient(object):
+    '''Minimal blocking client, mostly for testing; clients in other languages
+    only need HEADER and PAYLOADS.'''
+
+    def __init__(self, address, mask=ALL_FRAMES):
+        self.sock = socket.socket(_family(address), socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.sock.sendall(struct.pack('B', mask))
+        self.buf = bytearray()
+
+    def frames(self):
+        while True:
+            data = self.sock.recv(1 << 16)
+            if not data: return
+            self.buf += data
+            res, n = parse_frames(self.buf)
+            del self.buf[:n]
+            for f in res:
+                yield f
+
+    def close(self):
+        self.sock.close()
+
+
+def selftest(address=('127.0.0.1', 0), n_clients=8, n_frames=20000):
+    '''Serves synthetic EMG batches to n_clients fast clients and one that
+    stops reading, and checks that the fast ones get every frame while the
+    slow one only costs it its own frames.'''
+    server = StreamServer(address, max_queue=1 << 14)
+    received = [0] * n_clients
+
+    def fast(i):
+        c = StreamClient(server.address, 1 << FRAME_EMG)
+        for typ, t, samples in c.frames():
+            received[i] += 1
+        c.close()
+
+    threads = [threading.Thread(target=fast, args=(i,)) for i in range(n_clients)]
+    for th in threads: th.start()
+    slow = StreamClient(server.address)
+    emg_only = 1 << FRAME_EMG
+    while sum(c.mask == emg_only for c in server.clients.values()) < n_clients:
+        server.poll(.01)
+
+    data = frame(FRAME_EMG, [tuple(range(8)) + (0,)] * BATCH)
+    t0 = time.time()
+    sent = 0
+    while sent < n_frames:
+        ## only publish when the fast clients have room, as a real device's
+        ## rate would allow
+        if all(len(c.out) < 1 << 13 for c in server.clients.values() if c.mask == emg_only):
+            server.publish(data, FRAME_EMG)
+            sent += 1
+        server.poll(0)
+    while any(c.out for c in server.clients.values() if c.mask == emg_only):
+        server.poll(.01)
+    dt = time.time() - t0
+
+    dropped = [c.dropped for c in server.clients.values()]
+    server.close()
+    for th in threads: th.join()
+    slow.close()
+
+    assert received == [n_frames] * n_clients, received
+    assert max(dropped) > 0
+    print('%d frames to %d clients in %.2f s (%.0f frames/s), slow client dropped %d' %
+          (n_frames, n_clients, dt, n_frames * n_clients / dt, max(dropped)))
+
+
+if __name__ == '__main__':
+    ## usage: stream_server.py [--selftest] [ADDRESS [TTY]]
+    ## ADDRESS is a socket path, or a port to serve on 127.0.0.1
+    if '--selftest' in sys.argv:
+        selftest()
+        sys.exit(0)
+
+    from myoraw.myo import Myo, NNClassifier
+
+    address = sys.argv[1] if len(sys.argv) >= 2 else '/tmp/myosport.sock'
+    if address.isdigit():
+        address = ('127.0.0.1', int(address))
+
+    m = Myo(NNClassifier(), sys.argv[2] if len(sys.argv) >= 3 else None)
+    server = StreamServer(address)
+    daemon = StreamDaemon(m, server)
+    m.connect()
+    print('serving on', server.address)
+
+    try:
+        while True:
+            daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        m.disconnect()
+        server.close()
+        print()
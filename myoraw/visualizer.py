@@ -0,0 +1,147 @@
+from __future__ import print_function
+
+import threading
+import time
+
+import numpy as np
+
+## pixels per sample, horizontally
+PX = 5
+FPS = 30
+
+## (scale, offset) bringing raw values to 0..1, per kind of data
+SCALES = {
+    'emg': (1 / 2000., 0),
+    'quat': (1 / 32768., .5),
+    'acc': (1 / 8192., .5),
+    'gyro': (1 / 4000., .5),
+}
+
+
+class Stream(object):
+    '''Ring buffer of the last samples of a few channels. Producers push from
+    their thread; the renderer takes what arrived since its last frame.'''
+
+    def __init__(self, channels, scale, offset, length):
+        self.data = np.zeros((length, channels), np.float32)
+        self.scale = scale
+        self.offset = offset
+        self.length = length
+        self.n = 0
+        self.drawn = 0
+        self.lock = threading.Lock()
+
+    def push(self, samples):
+        samples = np.asarray(samples, np.float32).reshape(-1, self.data.shape[1])
+        samples = samples[-self.length:]
+        with self.lock:
+            i = self.n % self.length
+            k = min(len(samples), self.length - i)
+            self.data[i:i + k] = samples[:k]
+            self.data[:len(samples) - k] = samples[k:]
+            self.n += len(samples)
+
+    def new(self, max_n):
+        '''Returns the samples pushed since the last call (at most max_n of
+        them), brought to 0..1.'''
+        with self.lock:
+            n = min(self.n - self.drawn, max_n, self.length)
+            idx = np.arange(self.n - n, self.n) % self.length
+            res = self.data[idx]
+            self.drawn = self.n
+        return np.clip(res * self.scale + self.offset, 0, 1)
+
+
+class Visualizer(object):
+    '''Scrolling display of any number of streams, e.g. the EMG and IMU of
+    several Myos, one horizontal band each.
+
+    Data is only buffered when it arrives; drawing happens in run(), at most
+    fps times per second, with all the samples that arrived since the last
+    frame drawn at once. The Myos are run from other threads (see receive()).'''
+
+    def __init__(self, w=1200, h=400, fps=FPS, px=PX):
+        self.w, self.h = w, h
+        self.fps = fps
+        self.px = px
+        self.streams = []
+        self.running = False
+
+    def add_stream(self, name, channels, scale=1., offset=0.):
+        s = Stream(channels, scale, offset, self.w // self.px)
+        s.name = name
+        self.streams.append(s)
+        return s
+
+    def attach(self, m, emg=True, imu=False):
+        '''Adds streams for the data of MyoRaw m.'''
+        if emg:
+            s = self.add_stream('emg', 8, *SCALES['emg'])
+            m.add_emg_handler(lambda emg, moving: s.push(emg))
+        if imu:
+            streams = [self.add_stream(k, n, *SCALES[k]) for k, n in
+                       (('quat', 4), ('acc', 3), ('gyro', 3))]
+            def h(quat, acc, gyro):
+                for s, v in zip(streams, (quat, acc, gyro)):
+                    s.push(v)
+            m.add_imu_handler(h)
+
+    def receive(self, step):
+        '''Calls step() repeatedly in a daemon thread for as long as the
+        visualizer runs, e.g. step=lambda: m.run(.1) for a MyoRaw m.'''
+        def loop():
+            while not self.running: time.sleep(.01)
+            while self.running:
+                step()
+        th = threading.Thread(target=loop)
+        th.daemon = True
+        th.start()
+        return th
+
+    def columns(self, n):
+        '''Builds the pixels of the last n samples of every stream, as a
+        (n * px, h, 3) array.'''
+        img = np.zeros((n * self.px, self.h, 3), np.uint8)
+        rows = sum(s.data.shape[1] for s in self.streams)
+        y = 0
+        for s in self.streams:
+            v = s.new(n)
+            ch = v.shape[1]
+            ## right-align, in case this stream got fewer samples
+            v = np.vstack([np.zeros((n - len(v), ch), np.float32), v])
+            y0, y1 = y * self.h // rows, (y + ch) * self.h // rows
+            ## one row of pixels per screen line, mapped to its channel
+            lines = (np.arange(y1 - y0) * ch) // (y1 - y0)
+            img[:, y0:y1] = (255 * v[:, lines]).astype(np.uint8).repeat(self.px, 0)[..., None]
+            y += ch
+        return img
+
+    def run(self, on_key=None):
+        '''Draws until the window is closed or q is pressed; other key presses
+        are passed to on_key.'''
+        import pygame
+        from pygame.locals import QUIT, KEYDOWN
+
+        pygame.init()
+        scr = pygame.display.set_mode((self.w, self.h))
+        clock = pygame.time.Clock()
+        self.running = True
+        try:
+            while self.running:
+                for ev in pygame.event.get():
+                    if ev.type == QUIT or (ev.type == KEYDOWN and ev.unicode == 'q'):
+                        self.running = False
+                    elif ev.type == KEYDOWN and on_key is not None:
+                        on_key(ev)
+
+                n = max([s.n - s.drawn for s in self.streams] + [0])
+                n = min(n, self.w // self.px)
+                if n:
+                    d = n * self.px
+                    scr.scroll(-d)
+                    scr.blit(pygame.surfarray.make_surface(self.columns(n)), (self.w - d, 0))
+                    pygame.display.flip()
+                clock.tick(self.fps)
+        finally:
+            self.running = False
+            pygame.quit()
@@ -0,0 +1,19 @@
+# Copyright (c) 2015 Gilles Lourdelet
+# MIT Licence (MIT)
+# Please see LICENSE file for details.
+"""Installs the myoraw package and the myosport command; the tools are run from
+the source tree."""
+
+from setuptools import setup
+
+setup(
+    name="myosport",
+    version="0.1.0",
+    description="Online classification of sport gestures with the Myo armband",
+    license="MIT",
+    packages=["myoraw"],
+    python_requires=">=3.8",
+    install_requires=["numpy", "pyserial"],
+    extras_require={"sklearn": ["scikit-learn"], "gui": ["pygame"]},
+    entry_points={"console_scripts": ["myosport = myoraw.cli:main"]},
+)
@@ -0,0 +1,212 @@
+# Copyright (c) 2015 Gilles Lourdelet
+# MIT Licence (MIT)
+# Please see LICENSE file for details.
+"""This module generates augmented mini-batches of gestures for training,
+from a columnar export of recordings (see columnar.py), memory-mapped so that
+only the gestures drawn are read.
+
+Every gesture of a batch is resampled to a fixed length, with, in this order:
+- time warping: its speed varies smoothly along the gesture;
+- channel rotation: the 8 EMG channels are rotated by a few electrodes, as
+  when the armband is worn turned;
+- amplitude scaling, per channel;
+- noise, proportional to each channel's spread.
+All of it is computed on whole batches with NumPy.
+
+Batches are reproducible: the gestures of each epoch are shuffled with a
+generator seeded from (seed, epoch), and batch b of epoch e is augmented with
+one seeded from (seed, e, b), whichever worker process computes it. Workers
+compute the next batches ahead of time, so that training doesn't wait.
+
+Usage: augment.py [--batch-size N] [--length N] [--seed N] [--processes N]
+                  [--batches N] EXPORT
+runs the generator and reports its throughput.
+"""
+
+from __future__ import print_function
+import argparse
+import collections
+import multiprocessing
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np                                      # pylint: disable=wrong-import-position
+
+from tools.columnar import load                         # pylint: disable=wrong-import-position
+
+EMG_CHANNELS = 8
+
+
+class Augmenter(object):                # pylint: disable=too-few-public-methods
+    """Draws augmented versions of gestures of a columnar export. Setting a
+    parameter to 0 disables the corresponding augmentation."""
+
+    def __init__(self, length=64, fields=("emg",), warp=0.2, knots=4,
+                 max_shift=1, scale=0.1, noise=0.05):
+        # pylint: disable=too-many-arguments
+        self.length = length
+        self.fields = fields
+        self.warp = warp
+        self.knots = knots
+        self.max_shift = max_shift
+        self.scale = scale
+        self.noise = noise
+
+    def positions(self, lengths, rng):
+        """Returns the (batch, length) positions at which to sample gestures
+        of the given lengths: evenly spaced, unless warped."""
+        grid = np.linspace(0., 1., self.length)
+        if self.warp:
+            # Speed along each gesture, interpolated between random knots.
+            speed = np.maximum(1 + self.warp * rng.standard_normal((len(lengths), self.knots)), .1)
+            at = grid * (self.knots - 1)
+            low = np.minimum(at.astype(int), self.knots - 2)
+            frac = at - low
+            speed = speed[:, low] * (1 - frac) + speed[:, low + 1] * frac
+            time_ = np.cumsum(speed, 1)
+            grid = (time_ - time_[:, :1]) / (time_[:, -1:] - time_[:, :1])
+        return grid * (lengths - 1)[:, None]
+
+    def batch(self, columns, indices, rng):
+        """Returns the augmented gestures indices of columns as a
+        (batch, channels, length) float32 array."""
+        starts = columns.gesture_offsets[indices]
+        lengths = columns.gesture_offsets[np.asarray(indices) + 1] - starts
+        pos = self.positions(lengths, rng)
+        low = np.floor(pos).astype(np.int64)
+        high = np.minimum(low + 1, (lengths - 1)[:, None])
+        frac = (pos - low)[None]
+        low += starts[:, None]
+        high += starts[:, None]
+
+        parts = []
+        for field in self.fields:
+            column = getattr(columns, field)
+            # Only the samples needed are read from the memory map.
+            part = column[:, low] * (1 - frac) + column[:, high] * frac
+            part = part.transpose(1, 0, 2)
+            if field == "emg" and self.max_shift:
+                shifts = rng.integers(-self.max_shift, self.max_shift + 1, len(indices))
+                channels = (np.arange(EMG_CHANNELS)[None, :] - shifts[:, None]) % EMG_CHANNELS
+                part = np.take_along_axis(part, channels[:, :, None], 1)
+            parts.append(part)
+        x = np.concatenate(parts, 1)
+
+        if self.scale:
+            x *= 1 + self.scale * rng.standard_normal(x.shape[:2] + (1,))
+        if self.noise:
+            spread = x.std(2, keepdims=True)
+            x += self.noise * spread * rng.standard_normal(x.shape)
+        return x.astype(np.float32)
+
+
+def batch_rng(seed, epoch, batch):
+    """Returns the random generator of a batch."""
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(epoch, batch)))
+
+
+# Export and augmenter of a worker process, set once per worker.
+_worker_columns = None
+_worker_augmenter = None
+
+
+def _init_worker(path, augmenter):
+    """Maps the export."""
+    global _worker_columns, _worker_augmenter  # pylint: disable=global-statement
+    _worker_columns = load(path)
+    _worker_augmenter = augmenter
+
+
+def _batch_worker(task):
+    """Computes one batch."""
+    seed, epoch, batch, indices = task
+    return _worker_augmenter.batch(_worker_columns, indices, batch_rng(seed, epoch, batch))
+
+
+class BatchGenerator(object):
+    """Iterates over (gestures, labels) mini-batches of augmented gestures of
+    a columnar export, for the given number of epochs (forever if None).
+    Gestures are those of indices (all by default); labels are their
+    gesture_type. With processes=0, batches are computed in this process."""
+
+    def __init__(self, path, batch_size=32, seed=0, augmenter=None,
+                 indices=None, epochs=None, processes=None, prefetch=None):
+        # pylint: disable=too-many-arguments
+        self.path = path
+        self.batch_size = batch_size
+        self.seed = seed
+        self.augmenter = augmenter if augmenter is not None else Augmenter()
+        self.columns = load(path)
+        self.indices = (np.arange(len(self.columns)) if indices is None
+                        else np.asarray(indices))
+        self.epochs = epochs
+        self.processes = processes if processes is not None else multiprocessing.cpu_count()
+        self.prefetch = prefetch if prefetch is not None else 2 * max(self.processes, 1)
+
+    def tasks(self):
+        """Yields the (seed, epoch, batch, indices) of every batch."""
+        epoch = 0
+        while self.epochs is None or epoch < self.epochs:
+            order = np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(epoch,))
+                                         ).permutation(self.indices)
+            for batch, start in enumerate(range(0, len(order), self.batch_size)):
+                yield self.seed, epoch, batch, order[start:start + self.batch_size]
+            epoch += 1
+
+    def __iter__(self):
+        labels = self.columns.gesture_type
+        if not self.processes:
+            for task in self.tasks():
+                seed, epoch, batch, indices = task
+                yield (self.augmenter.batch(self.columns, indices, batch_rng(seed, epoch, batch)),
+                       np.asarray(labels[indices]))
+            return
+
+        pool = multiprocessing.Pool(self.processes, _init_worker, (self.path, self.augmenter))
+        try:
+            # Batches are computed ahead, and handed out in order.
+            pending = collections.deque()
+            for task in self.tasks():
+                pending.append((pool.apply_async(_batch_worker, (task,)), task[3]))
+                if len(pending) >= self.prefetch:
+                    result, indices = pending.popleft()
+                    yield result.get(), np.asarray(labels[indices])
+            while pending:
+                result, indices = pending.popleft()
+                yield result.get(), np.asarray(labels[indices])
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def main():
+    """Measures the generator's throughput from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("export")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--length", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--batches", type=int, default=200)
+    args = parser.parse_args()
+
+    generator = BatchGenerator(args.export, args.batch_size, args.seed,
+                               Augmenter(args.length), processes=args.processes)
+    start = time.time()
+    gestures_nbr = 0
+    for i, (x, _) in enumerate(generator):
+        gestures_nbr += len(x)
+        if i + 1 == args.batches:
+            break
+    elapsed = time.time() - start
+    print("%d batches of %s in %.2f s: %.0f gestures/s"
+          % (args.batches, x.shape[1:], elapsed, gestures_nbr / elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
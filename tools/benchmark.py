@@ -0,0 +1,325 @@
+# Copyright (c) 2015 Gilles Lourdelet
+# MIT Licence (MIT)
+# Please see LICENSE file for details.
+"""This module benchmarks the hot paths of the protocol, storage and
+classification code, without any hardware: the Myo is replaced by synthetic
+byte streams and a 'loop://' serial port.
+
+Every benchmark runs in several rounds, interleaved with the others so that
+the machine's slow and fast moments show in all of them, and every result is
+the median of all its repetitions, stored with its spread (the median
+absolute deviation, relative to the median). Results are written
+as JSON and compared against a stored baseline: a result worse than the
+baseline by more than the tolerance plus NOISE times the larger of the two
+spreads is a suspected regression, and its benchmark is run again. Only the
+regressions that remain are reported, and make the script exit with
+status 1.
+
+Usage: benchmark.py [--quick] [--out FILE] [--baseline FILE] [--save-baseline]
+                    [--tolerance FRACTION]
+"""
+
+from __future__ import print_function
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np                                      # pylint: disable=wrong-import-position
+
+from myoraw.myo_raw import BT, MyoRaw                   # pylint: disable=wrong-import-position
+from myoraw.data_file import (Gesture, GestureType,     # pylint: disable=wrong-import-position
+                              Recording)
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "benchmark_baseline.json")
+TOLERANCE = 0.25
+# Spreads added to the tolerance.
+NOISE = 3
+ROUNDS = 5
+REPEAT = 3
+
+
+def _timings(func, repeat):
+    """Returns repeat timings of func(), in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _median(values):
+    """Returns the median of a list of numbers."""
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.
+
+
+def _emg_packet_bytes(emg, moving=0):
+    """Returns the raw bytes of an EMG notification packet, as the dongle
+    sends them."""
+    payload = struct.pack("<BHBB8HB", 0, 0x27, 0, 18, *(tuple(emg) + (moving,)))
+    return bytes([0x80, len(payload), 4, 5]) + payload
+
+
+def _imu_packet_bytes(quat, acc, gyro):
+    """Returns the raw bytes of an IMU notification packet."""
+    payload = struct.pack("<BHBB10h", 0, 0x1c, 0, 20,
+                          *(tuple(quat) + tuple(acc) + tuple(gyro)))
+    return bytes([0x80, len(payload), 4, 5]) + payload
+
+
+def _synthetic_stream(packets_nbr):
+    """Returns a byte stream of interleaved EMG and IMU packets."""
+    rng = random.Random(0)
+    chunks = []
+    for i in range(packets_nbr):
+        if i % 2:
+            chunks.append(_imu_packet_bytes([rng.randint(-16384, 16384) for _ in range(4)],
+                                            [rng.randint(-2048, 2048) for _ in range(3)],
+                                            [rng.randint(-2000, 2000) for _ in range(3)]))
+        else:
+            chunks.append(_emg_packet_bytes([rng.randint(0, 2000) for _ in range(8)]))
+    return b"".join(chunks)
+
+
+def _synthetic_recording(gestures_nbr, samples_nbr):
+    """Returns a Recording filled with arbitrary values."""
+    recording = Recording()
+    recording.set_player_id(1)
+    recording.set_gesture_type(GestureType.FOREHAND_SMASH)
+    for i in range(gestures_nbr):
+        gesture = Gesture()
+        for j in range(samples_nbr):
+            gesture.append_sample([i + j] * 8, [i] * 4, [j] * 3, [i - j] * 3)
+        recording.append_gesture(gesture)
+    return recording
+
+
+def bench_proc_byte(scale, repeat):
+    """Framing throughput of BT.proc_byte over a synthetic byte stream."""
+    stream = _synthetic_stream(20000 * scale)
+    bt = BT("loop://")
+
+    def run():
+        proc_byte = bt.proc_byte
+        for c in stream:
+            proc_byte(c)
+    timings = _timings(run, repeat)
+    bt.ser.close()
+    return {"bt.proc_byte": ([len(stream) / t / 1e6 for t in timings], "MB/s", True)}
+
+
+def bench_handle_data(scale, repeat):
+    """Decoding rate of MyoRaw.handle_data, without any handler attached."""
+    stream = _synthetic_stream(20000 * scale)
+    m = MyoRaw("loop://")
+    packets = []
+    for c in stream:
+        packet = m.bt.proc_byte(c)
+        if packet:
+            packets.append(packet)
+
+    def run():
+        handle_data = m.handle_data
+        for packet in packets:
+            handle_data(packet)
+    timings = _timings(run, repeat)
+    m.bt.ser.close()
+    return {"myo.handle_data": ([len(packets) / t / 1e3 for t in timings], "kpackets/s", True)}
+
+
+def bench_recording(scale, repeat):
+    """Recording.pack_into_file and unpack_from_file throughput."""
+    recording = _synthetic_recording(20 * scale, 200)
+    buf = io.BytesIO()
+    recording.pack_into_file(buf)
+    size = buf.tell()
+
+    def pack():
+        recording.pack_into_file(io.BytesIO())
+
+    def unpack():
+        Recording.unpack_from_file(io.BytesIO(buf.getvalue()))
+    return {"recording.pack": ([size / t / 1e6 for t in _timings(pack, repeat)],
+                               "MB/s", True),
+            "recording.unpack": ([size / t / 1e6 for t in _timings(unpack, repeat)],
+                                 "MB/s", True)}
+
+
+def bench_nn_classifier(scale, repeat):
+    """NNClassifier.store_data and classify latency against dataset size."""
+    from myoraw.myo import NNClassifier
+
+    results = {}
+    rng = np.random.RandomState(0)
+    cwd = os.getcwd()
+    tmp = tempfile.mkdtemp()
+    try:
+        # NNClassifier keeps its training data in the working directory.
+        os.chdir(tmp)
+        cls = NNClassifier()
+        for size in (1000, 10000 * scale):
+            X = rng.randint(0, 2000, (size, 8)).astype(np.uint16)
+            Y = rng.randint(0, 10, size).astype(np.float64)
+            queries = rng.randint(0, 2000, (20, 8)).astype(np.uint16)
+
+            timings = []
+            for _ in range(repeat):
+                cls.train(X, Y)
+                start = time.perf_counter()
+                for q in queries:
+                    cls.store_data(int(q[0]) % 10, q)
+                timings.append(time.perf_counter() - start)
+            results["nn.store_data@%d" % size] = (
+                [t / len(queries) * 1e3 for t in timings], "ms", False)
+
+            def classify():
+                for q in queries:
+                    cls.classify(q)
+            cls.train(X, Y)
+            results["nn.classify@%d" % size] = (
+                [t / len(queries) * 1e3 for t in _timings(classify, repeat)], "ms", False)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp)
+    return results
+
+
+class _ConstantClassifier(object):        # pylint: disable=too-few-public-methods
+    """A classifier costing nothing, so that only the smoothing of its
+    decisions is measured."""
+
+    def __init__(self):
+        rng = random.Random(0)
+        self.labels = [rng.randint(0, 9) for _ in range(1000)]
+        self.i = 0
+
+    def classify(self, _):
+        """Returns the next label of a fixed, blocky sequence."""
+        self.i += 1
+        return self.labels[(self.i // 20) % len(self.labels)]
+
+
+def bench_emg_handler(scale, repeat):
+    """Cost of Myo.emg_handler's decision smoothing per EMG sample."""
+    from myoraw.myo import Myo
+
+    m = Myo(_ConstantClassifier(), "loop://")
+    samples_nbr = 10000 * scale
+    emg = (0,) * 8
+
+    def run():
+        handler = m.emg_handler
+        for _ in range(samples_nbr):
+            handler(emg, 0)
+    timings = _timings(run, repeat)
+    m.bt.ser.close()
+    return {"myo.emg_handler": ([t / samples_nbr * 1e6 for t in timings], "us", False)}
+
+
+BENCHMARKS = [bench_proc_byte, bench_handle_data, bench_recording,
+              bench_nn_classifier, bench_emg_handler]
+
+
+def run_all(scale=1, repeat=REPEAT, rounds=ROUNDS, benchmarks=None):
+    """Runs every benchmark (or the given ones) in rounds and returns a dict
+    of name: {value, spread, unit, higher_is_better, benchmark}."""
+    values = {}
+    results = {}
+    for _ in range(rounds):
+        for bench in benchmarks or BENCHMARKS:
+            for name, (round_values, unit, higher) in bench(scale, repeat).items():
+                values.setdefault(name, []).extend(round_values)
+                results[name] = {"unit": unit, "higher_is_better": higher,
+                                 "benchmark": bench.__name__}
+    for name, res in results.items():
+        res["value"] = value = _median(values[name])
+        res["spread"] = _median([abs(v - value) for v in values[name]]) / value
+        print("%-24s %12.3f %-10s +/- %4.1f%%" % (name, value, res["unit"],
+                                                  100 * res["spread"]))
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Returns the list of (name, value, baseline value) of the results worse
+    than the baseline by more than tolerance, widened by the spreads."""
+    regressions = []
+    for name, res in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        margin = tolerance + NOISE * max(res.get("spread", 0), base.get("spread", 0))
+        if res["higher_is_better"]:
+            worse = res["value"] < base["value"] * (1 - margin)
+        else:
+            worse = res["value"] > base["value"] * (1 + margin)
+        if worse:
+            regressions.append((name, res["value"], base["value"]))
+    return regressions
+
+
+def main():
+    """Runs the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--quick", action="store_true",
+                        help="a single round, for smoke testing")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    rounds = 1 if args.quick else ROUNDS
+    results = run_all(rounds=rounds)
+    report = {"python": platform.python_version(),
+              "machine": platform.machine(),
+              "results": results}
+    if args.out:
+        with open(args.out, "w") as out_file:
+            json.dump(report, out_file, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as out_file:
+            json.dump(report, out_file, indent=2, sort_keys=True)
+        print("Baseline saved to %s" % args.baseline)
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print("No baseline at %s; run with --save-baseline." % args.baseline)
+        return 0
+    with open(args.baseline) as in_file:
+        baseline = json.load(in_file)["results"]
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        # A suspected regression must show again to be reported.
+        print("Running the suspected regressions again...")
+        names = set(name for name, _, _ in regressions)
+        again = run_all(rounds=rounds, benchmarks=[
+            bench for bench in BENCHMARKS
+            if bench.__name__ in set(results[name]["benchmark"] for name in names)])
+        regressions = [r for r in compare(again, baseline, args.tolerance) if r[0] in names]
+    for name, value, base in regressions:
+        print("### REGRESSION: %s = %.3f (baseline %.3f)" % (name, value, base))
+    if not regressions:
+        print("No regression against %s." % args.baseline)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
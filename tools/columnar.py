@@ -0,0 +1,247 @@
+# Copyright (c) 2015 Gilles Lourdelet
+# MIT Licence (MIT)
+# Please see LICENSE file for details.
+"""This module exports recordings into a columnar layout for bulk analysis,
+and loads it back.
+
+The samples of every gesture of the exported files are laid end to end: each
+GestureSample field is stored as a (channels, samples) int32 array, so that
+every channel is contiguous (emg.npy, quat.npy, acc.npy, gyro.npy). Gesture i
+spans samples gesture_offsets[i] to gesture_offsets[i + 1]; its player,
+gesture type, frame rate and source file are in the per-gesture arrays
+player_id, gesture_type, rec_frame_rate and file_index, and metadata.json
+lists the source files.
+
+The export is either a directory of .npy files, which load() memory-maps, or
+an .npz archive holding the same files. Arrays are filled gesture by gesture
+through memory maps, so exporting takes little memory and mostly waits on the
+disk.
+
+Usage: columnar.py [--compress] OUTPUT RECORDING...
+       columnar.py --test
+OUTPUT is an .npz file or a directory. --test runs the unit tests.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np                                      # pylint: disable=wrong-import-position
+
+from myoraw.data_file import (CorruptedFileError,      # pylint: disable=wrong-import-position
+                              GestureType, Recording)
+from tools.file_ops import iter_gestures                # pylint: disable=wrong-import-position
+
+# GestureSample fields, with their number of channels, in sample order.
+FIELDS = (("emg", 8), ("quat", 4), ("acc", 3), ("gyro", 3))
+GESTURE_ARRAYS = ("player_id", "gesture_type", "rec_frame_rate", "file_index")
+METADATA = "metadata.json"
+
+
+def export_directory(paths, directory):
+    """Exports the given recording files into a directory of .npy files.
+    Returns the numbers of gestures and samples exported."""
+    # A first pass over the headers sizes the arrays.
+    gestures_nbr = samples_nbr = 0
+    for path in paths:
+        for ref in iter_gestures(path):
+            gestures_nbr += 1
+            samples_nbr += ref.header.samples_nbr
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    def create(name, shape, dtype):
+        """Creates an .npy file mapped in memory."""
+        return np.lib.format.open_memmap(os.path.join(directory, name + ".npy"),
+                                         "w+", dtype, shape)
+    columns = [(create(name, (channels, samples_nbr), np.int32), channels)
+               for name, channels in FIELDS]
+    offsets = create("gesture_offsets", (gestures_nbr + 1,), np.int64)
+    per_gesture = dict((name, create(name, (gestures_nbr,), np.int32))
+                       for name in GESTURE_ARRAYS)
+
+    gesture = position = 0
+    offsets[0] = 0
+    for file_index, path in enumerate(paths):
+        for ref in iter_gestures(path):
+            ref.bin_file.seek(ref.data_offset)
+            data = ref.bin_file.read(ref.size)
+            if len(data) < ref.size or not ref.header.check_crc(data):
+                raise CorruptedFileError("%s: gesture %d is corrupted"
+                                         % (path, ref.index))
+            samples = np.frombuffer(data, "<i4").reshape((ref.header.samples_nbr, -1))
+            end = position + ref.header.samples_nbr
+            first = 0
+            for column, channels in columns:
+                column[:, position:end] = samples[:, first:first + channels].T
+                first += channels
+            per_gesture["player_id"][gesture] = ref.file_header.player_id
+            per_gesture["gesture_type"][gesture] = ref.file_header.gesture_type
+            per_gesture["rec_frame_rate"][gesture] = ref.file_header.rec_frame_rate
+            per_gesture["file_index"][gesture] = file_index
+            gesture += 1
+            offsets[gesture] = position = end
+
+    for array in [column for column, _ in columns] + [offsets] + list(per_gesture.values()):
+        array.flush()
+    with open(os.path.join(directory, METADATA), "w") as meta_file:
+        json.dump({"files": [os.path.abspath(p) for p in paths],
+                   "fields": dict(FIELDS),
+                   "gestures_nbr": gestures_nbr,
+                   "samples_nbr": samples_nbr}, meta_file, indent=2, sort_keys=True)
+    return gestures_nbr, samples_nbr
+
+
+def export_npz(paths, npz_path, compress=False):
+    """Exports the given recording files into an .npz archive, by zipping an
+    export directory built next to it."""
+    directory = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(npz_path)))
+    try:
+        result = export_directory(paths, directory)
+        compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        with zipfile.ZipFile(npz_path, "w", compression, allowZip64=True) as archive:
+            for name in sorted(os.listdir(directory)):
+                archive.write(os.path.join(directory, name), name)
+    finally:
+        shutil.rmtree(directory)
+    return result
+
+
+def export(paths, output, compress=False):
+    """Exports into an .npz archive if output ends with .npz, or else into a
+    directory."""
+    if output.endswith(".npz"):
+        return export_npz(paths, output, compress)
+    return export_directory(paths, output)
+
+
+class Columns(object):
+    """An export loaded back: the arrays are attributes named after their
+    file, and metadata holds metadata.json's contents."""
+
+    def __init__(self, path, mmap=True):
+        if os.path.isdir(path):
+            mode = "r" if mmap else None
+            for name in os.listdir(path):
+                if name.endswith(".npy"):
+                    setattr(self, name[:-4], np.load(os.path.join(path, name), mmap_mode=mode))
+            with open(os.path.join(path, METADATA)) as meta_file:
+                self.metadata = json.load(meta_file)
+        else:
+            # Arrays of an archive can't be mapped; they are read as a whole.
+            with np.load(path) as archive:
+                for name in archive.files:
+                    if name != METADATA:
+                        setattr(self, name, archive[name])
+            with zipfile.ZipFile(path) as archive:
+                self.metadata = json.loads(archive.read(METADATA).decode("utf-8"))
+
+    def __len__(self):
+        return len(self.gesture_offsets) - 1
+
+    def gesture(self, i, field="emg"):
+        """Returns a (channels, samples) view of a field of gesture i."""
+        return getattr(self, field)[:, self.gesture_offsets[i]:self.gesture_offsets[i + 1]]
+
+
+def load(path, mmap=True):
+    """Loads an export directory (memory-mapped unless mmap is False) or
+    archive."""
+    return Columns(path, mmap)
+
+
+def main():
+    """Exports recordings from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("output")
+    parser.add_argument("recordings", nargs="+")
+    parser.add_argument("--compress", action="store_true",
+                        help="deflate the .npz archive (which is then slower to load)")
+    args = parser.parse_args()
+
+    gestures_nbr, samples_nbr = export(args.recordings, args.output, args.compress)
+    print("%s: %d gestures, %d samples" % (args.output, gestures_nbr, samples_nbr))
+    return 0
+
+
+################################################################################
+#     UNIT TESTS
+################################################################################
+
+def unit_test_round_trip():
+    """Tests that exports to directories and archives load back the samples
+    and headers of the recordings."""
+
+    from tools.integrity import write_test_recording
+    print ("    - Testing export and load round-trip...")
+
+    directory = tempfile.mkdtemp()
+    try:
+        paths = [os.path.join(directory, name) for name in ("a.dat", "b.dat")]
+        write_test_recording(paths[0], [3, 4, 5], 1, GestureType.FOREHAND_SMASH)
+        write_test_recording(paths[1], [6, 7], 2, GestureType.FOREHAND_CLEAR)
+        recordings = []
+        for path in paths:
+            with open(path, "rb") as bin_file:
+                recordings.append(Recording.unpack_from_file(bin_file))
+
+        outputs = [(os.path.join(directory, "columns"), False, True),
+                   (os.path.join(directory, "columns"), False, False),
+                   (os.path.join(directory, "columns.npz"), False, False),
+                   (os.path.join(directory, "deflated.npz"), True, False)]
+        for output, compress, mmap in outputs:
+            assert export(paths, output, compress) == (5, 25)
+            columns = load(output, mmap)
+            assert len(columns) == 5
+            assert columns.emg.shape == (8, 25) and columns.gyro.shape == (3, 25)
+            assert columns.metadata["files"] == [os.path.abspath(p) for p in paths]
+            assert columns.metadata["samples_nbr"] == 25
+            i = 0
+            for file_index, recording in enumerate(recordings):
+                header = recording.file_header
+                for gesture in recording.gestures:
+                    assert columns.player_id[i] == header.player_id
+                    assert columns.gesture_type[i] == header.gesture_type
+                    assert columns.rec_frame_rate[i] == header.rec_frame_rate
+                    assert columns.file_index[i] == file_index
+                    for field, _ in FIELDS:
+                        expected = [getattr(s, field) for s in gesture.samples]
+                        assert columns.gesture(i, field).T.tolist() == \
+                            [list(v) for v in expected]
+                    i += 1
+            del columns
+
+        # A corrupted gesture fails the export.
+        with open(paths[1], "r+b") as bin_file:
+            bin_file.seek(-1, os.SEEK_END)
+            byte = bin_file.read(1)
+            bin_file.seek(-1, os.SEEK_END)
+            bin_file.write(struct.pack("B", ord(byte) ^ 1))
+        try:
+            export(paths, os.path.join(directory, "corrupted.npz"))
+        except CorruptedFileError:
+            pass
+        else:
+            assert False
+        assert not os.path.exists(os.path.join(directory, "corrupted.npz"))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--test"]:
+        print ("Testing columnar module:")
+        unit_test_round_trip()
+        print ("Test succeeded.")
+        sys.exit(0)
+    sys.exit(main())
@@ -0,0 +1,353 @@
+# Copyright (c) 2015 Gilles Lourdelet
+# MIT Licence (MIT)
+# Please see LICENSE file for details.
+"""This module measures how well the classifiers generalize, by
+cross-validating them over a catalog of recording files: leaving one player
+out at a time (does a model trained on some players recognize the gestures of
+another one?) or over k stratified folds.
+
+Folds are evaluated in parallel worker processes. The samples of the whole
+catalog are loaded once into shared memory, which the workers map read-only,
+instead of each of them receiving a pickled copy.
+
+Every model is given whole gestures as (samples, 18) arrays of emg, quat, acc
+and gyro columns (see COLUMNS) and must implement:
+- fit(gestures, labels): train on a list of gestures and their labels;
+- predict(gesture): return the label of one gesture.
+Models are created in the workers from a class and keyword arguments, so any
+module-level class can be plugged in, e.g. with --model package.module:Class.
+
+Usage: evaluate.py [--folds players|K] [--model NAME]... [--processes N]
+                   [--seed N] [--out FILE] RECORDING...
+"""
+
+from __future__ import print_function
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing import shared_memory
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np                                      # pylint: disable=wrong-import-position
+
+from myoraw.data_file import (CorruptedFileError,      # pylint: disable=wrong-import-position
+                              FileHeader, GestureHeader,
+                              GestureSample, GestureType)
+
+# Columns of each GestureSample field in the sample arrays.
+COLUMNS = {"emg": slice(0, 8), "quat": slice(8, 12),
+           "acc": slice(12, 15), "gyro": slice(15, 18)}
+CLASSES_NBR = len(GestureType)
+
+
+def _fields(gesture, fields):
+    """Returns the columns of the given fields of a gesture array."""
+    return np.hstack([gesture[:, COLUMNS[f]] for f in fields])
+
+
+class NNModel(object):
+    """Adapts myo.NNClassifier, which classifies single EMG samples, to whole
+    gestures: every sample votes for a label."""
+
+    def __init__(self):
+        self.cls = None
+
+    def fit(self, gestures, labels):
+        """Trains the classifier on every EMG sample of the gestures."""
+        from myoraw.myo import NNClassifier
+        X = np.vstack([g[:, COLUMNS["emg"]] for g in gestures])
+        Y = np.repeat(labels, [len(g) for g in gestures]).astype(np.float64)
+        self.cls = NNClassifier.from_arrays(X, Y)
+
+    def predict(self, gesture):
+        """Returns the label most of the gesture's samples were given."""
+        emg = gesture[:, COLUMNS["emg"]]
+        if self.cls.nn is not None:
+            # All of the gesture's samples go to the kd-tree at once.
+            votes = self.cls.nn.predict(emg).astype(int)
+        else:
+            votes = [int(self.cls.classify(s)) for s in emg]
+        return int(np.bincount(votes).argmax())
+
+
+class DTWModel(object):
+    """Adapts dtw.DTWClassifier, which already classifies whole gestures."""
+
+    def __init__(self, fields=("emg",), **kwargs):
+        self.fields = fields
+        self.kwargs = kwargs
+        self.cls = None
+
+    def fit(self, gestures, labels):
+        """Uses every gesture as a template."""
+        from myoraw.dtw import DTWClassifier
+        self.cls = DTWClassifier(fields=self.fields, **self.kwargs)
+        for gesture, label in zip(gestures, labels):
+            self.cls.add_template(label, _fields(gesture, self.fields))
+        self.cls.fit()
+
+    def predict(self, gesture):
+        """Returns the label of the nearest template."""
+        return self.cls.classify(_fields(gesture, self.fields))[0]
+
+
+MODELS = {"nn": (NNModel, {}), "dtw": (DTWModel, {})}
+
+
+def load_model_spec(name):
+    """Returns the (class, kwargs) of a model given by its MODELS name or as
+    'package.module:Class'."""
+    if name in MODELS:
+        return MODELS[name]
+    module, _, cls_name = name.partition(":")
+    return getattr(importlib.import_module(module), cls_name), {}
+
+
+class Catalog(object):                  # pylint: disable=too-few-public-methods
+    """The gestures of a set of recording files, as one (samples, 18) int32
+    array, with the offset, label, player and recorded frame rate of each
+    gesture."""
+
+    def __init__(self, samples, offsets, labels, players, rates):
+        self.samples = samples
+        self.offsets = offsets
+        self.labels = labels
+        self.players = players
+        self.rates = rates
+
+    def __len__(self):
+        return len(self.labels)
+
+    def gesture(self, i):
+        """Returns a view of the samples of gesture i."""
+        return self.samples[self.offsets[i]:self.offsets[i + 1]]
+
+    @classmethod
+    def load(cls, paths):
+        """Reads the given recording files, decoding their samples in bulk
+        rather than one GestureSample at a time."""
+        chunks, lengths, labels, players, rates = [], [], [], [], []
+        for path in paths:
+            with open(path, "rb") as bin_file:
+                file_header = FileHeader.unpack_from_file(bin_file)
+                for i in range(file_header.get_gestures_nbr()):
+                    header = GestureHeader.unpack_from_file(bin_file,
+                                                            file_header.version)
+                    size = header.samples_nbr * GestureSample.struct_size
+                    bin_data = bin_file.read(size)
+                    if len(bin_data) < size or not header.check_crc(bin_data):
+                        raise CorruptedFileError("%s: gesture %d is corrupted"
+                                                 % (path, i))
+                    data = np.frombuffer(bin_data, "<i4")
+                    chunks.append(data.reshape((header.samples_nbr, -1)))
+                    lengths.append(header.samples_nbr)
+                    labels.append(int(file_header.gesture_type))
+                    players.append(file_header.player_id)
+                    rates.append(file_header.rec_frame_rate)
+        samples = (np.vstack(chunks).astype(np.int32) if chunks
+                   else np.zeros((0, 18), np.int32))
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        return cls(samples, offsets, np.array(labels, np.int64),
+                   np.array(players, np.int64), np.array(rates, np.int64))
+
+    def share(self):
+        """Copies the catalog's arrays into new shared-memory blocks. Returns
+        the blocks, to be unlinked when done, and what attach() needs to map
+        them."""
+        blocks, specs = [], []
+        for array in (self.samples, self.offsets, self.labels, self.players,
+                      self.rates):
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, array.dtype, block.buf)[...] = array
+            blocks.append(block)
+            specs.append((block.name, array.shape, array.dtype.str))
+        return blocks, specs
+
+    @classmethod
+    def attach(cls, specs):
+        """Maps a shared catalog read-only, e.g. in a pool's worker process.
+        Returns it and its blocks, which must stay referenced while it is
+        used. A pool shares its parent's resource tracker, so only the
+        parent's unlink releases the blocks."""
+        blocks, arrays = [], []
+        for name, shape, dtype in specs:
+            block = shared_memory.SharedMemory(name)
+            array = np.ndarray(shape, dtype, block.buf)
+            array.flags.writeable = False
+            blocks.append(block)
+            arrays.append(array)
+        return cls(*arrays), blocks
+
+
+def player_folds(catalog):
+    """Returns one (name, test indices) fold per player."""
+    players = np.unique(catalog.players)
+    if len(players) < 2:
+        raise ValueError("leaving one player out needs at least 2 players")
+    return [("player %d" % p, np.flatnonzero(catalog.players == p))
+            for p in players]
+
+
+def kfold_folds(catalog, k, seed=0):
+    """Returns k (name, test indices) folds, each holding about the same
+    share of every label."""
+    if not 2 <= k <= len(catalog):
+        raise ValueError("cannot make %d folds of %d gestures" % (k, len(catalog)))
+    rng = np.random.RandomState(seed)
+    # Shuffle, then deal the gestures of each label round-robin.
+    order = rng.permutation(len(catalog))
+    order = order[np.argsort(catalog.labels[order], kind="stable")]
+    fold_of = np.empty(len(catalog), np.int64)
+    fold_of[order] = np.arange(len(catalog)) % k
+    return [("fold %d" % i, np.flatnonzero(fold_of == i)) for i in range(k)]
+
+
+# Catalog of a worker process and its shared-memory blocks, set once per
+# worker.
+_worker_catalog = None
+_worker_blocks = None
+
+
+def _init_worker(specs):
+    """Maps the shared catalog."""
+    global _worker_catalog, _worker_blocks  # pylint: disable=global-statement
+    _worker_catalog, _worker_blocks = Catalog.attach(specs)
+
+
+def evaluate_fold(catalog, model_spec, test):
+    """Trains a model on every gesture but test, and predicts those. Returns
+    the true labels, predicted labels, prediction times and sample counts."""
+    model_cls, kwargs = model_spec
+    train = np.setdiff1d(np.arange(len(catalog)), test)
+    model = model_cls(**kwargs)
+    model.fit([catalog.gesture(i) for i in train], catalog.labels[train])
+
+    predicted = np.empty(len(test), np.int64)
+    times = np.empty(len(test))
+    for j, i in enumerate(test):
+        gesture = catalog.gesture(i)
+        start = time.perf_counter()
+        predicted[j] = model.predict(gesture)
+        times[j] = time.perf_counter() - start
+    lengths = np.diff(catalog.offsets)[test]
+    return catalog.labels[test], predicted, times, lengths
+
+
+def _evaluate_worker(task):
+    """Runs one (model, fold) task on the shared catalog."""
+    model_spec, test = task
+    return evaluate_fold(_worker_catalog, model_spec, test)
+
+
+def cross_validate(catalog, models, folds, processes=None):
+    """Evaluates every model on every fold. models maps names to
+    (class, kwargs); returns a dict of reports by model name."""
+    tasks = [(models[name], test) for name in models for _, test in folds]
+    if processes == 1:
+        results = [evaluate_fold(catalog, spec, test) for spec, test in tasks]
+    else:
+        blocks, specs = catalog.share()
+        try:
+            pool = multiprocessing.Pool(processes, _init_worker, (specs,))
+            try:
+                results = pool.map(_evaluate_worker, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    reports = {}
+    for m, name in enumerate(models):
+        per_fold = results[m * len(folds):(m + 1) * len(folds)]
+        reports[name] = make_report([fold_name for fold_name, _ in folds], per_fold)
+    return reports
+
+
+def make_report(fold_names, per_fold):
+    """Sums up the results of the folds of one model."""
+    confusion = np.zeros((CLASSES_NBR, CLASSES_NBR), np.int64)
+    folds = {}
+    for fold_name, (true, predicted, _, _) in zip(fold_names, per_fold):
+        np.add.at(confusion, (true, predicted), 1)
+        folds[fold_name] = float((true == predicted).mean()) if len(true) else 0.
+    times = np.concatenate([r[2] for r in per_fold])
+    lengths = np.concatenate([r[3] for r in per_fold])
+
+    totals = confusion.sum(1)
+    present = np.flatnonzero(totals)
+    return {
+        "accuracy": float(np.trace(confusion)) / max(confusion.sum(), 1),
+        "folds": folds,
+        "recall": dict((GestureType(i).name, float(confusion[i, i]) / totals[i])
+                       for i in present),
+        "confusion": confusion.tolist(),
+        "latency": {
+            "per_gesture_p50": float(np.percentile(times, 50)) if len(times) else 0.,
+            "per_gesture_p99": float(np.percentile(times, 99)) if len(times) else 0.,
+            "per_sample_mean": float(times.sum() / max(lengths.sum(), 1)),
+        },
+    }
+
+
+def print_report(name, report):
+    """Prints a report in a human-readable form."""
+    print("=== %s: accuracy %.3f" % (name, report["accuracy"]))
+    for fold_name, accuracy in sorted(report["folds"].items()):
+        print("    %-16s %.3f" % (fold_name, accuracy))
+    latency = report["latency"]
+    print("    latency: %.3f ms/gesture (p50), %.3f ms (p99), %.1f us/sample"
+          % (latency["per_gesture_p50"] * 1e3, latency["per_gesture_p99"] * 1e3,
+             latency["per_sample_mean"] * 1e6))
+
+    confusion = np.array(report["confusion"])
+    used = [i for i in range(CLASSES_NBR) if confusion[i].any() or confusion[:, i].any()]
+    print("    confusion (rows: true, columns: predicted)")
+    print("    %22s" % "" + "".join("%6d" % j for j in used))
+    for i in used:
+        print("    %2d %-19s" % (i, GestureType(i).name[:19]) +
+              "".join("%6d" % confusion[i, j] for j in used))
+
+
+def main():
+    """Runs the evaluation from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("recordings", nargs="+")
+    parser.add_argument("--folds", default="players",
+                        help="'players' to leave one player out, or a number of folds")
+    parser.add_argument("--model", action="append",
+                        help="%s, or package.module:Class (repeatable)"
+                        % ", ".join(sorted(MODELS)))
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the reports as JSON to this file")
+    args = parser.parse_args()
+
+    catalog = Catalog.load(args.recordings)
+    if args.folds == "players":
+        folds = player_folds(catalog)
+    else:
+        folds = kfold_folds(catalog, int(args.folds), args.seed)
+    models = dict((name, load_model_spec(name)) for name in args.model or ["nn"])
+
+    print("%d gestures, %d samples, %d folds"
+          % (len(catalog), len(catalog.samples), len(folds)))
+    reports = cross_validate(catalog, models, folds, args.processes)
+    for name in models:
+        print_report(name, reports[name])
+    if args.out:
+        with open(args.out, "w") as out_file:
+            json.dump(reports, out_file, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
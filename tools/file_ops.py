@@ -0,0 +1,500 @@
+# Copyright (c) 2015 Gilles Lourdelet
+# MIT Licence (MIT)
+# Please see LICENSE file for details.
+"""This module combines, filters and splits recording files without loading
+them: gestures are found by jumping through their headers, and their samples
+are copied from input to output by chunks, so memory use doesn't depend on
+the size of the files. Samples are only decoded, one gesture at a time, when
+a filter on their values requires it.
+
+Every output is a recording file of the current format version; the gestures
+copied from version 1 files get their checksum computed on the way. Outputs
+are written to a temporary file that replaces them once complete, so an
+output may also be one of the inputs. A recording can't be empty: when no
+gesture matches, nothing is written and the command fails.
+
+A recording holds a single player and gesture type, so split keeps the
+gestures of each (player, type) pair apart, whatever it splits by: PATTERN
+must tell apart the pairs found in the inputs, e.g. 'p{player}_{type}.dat'.
+
+Usage: file_ops.py concat OUTPUT INPUT... [FILTER] [--player N] [--type T]
+       file_ops.py filter OUTPUT INPUT [FILTER]
+       file_ops.py split PATTERN INPUT... --by player|type|N [FILTER]
+       file_ops.py relabel OUTPUT INPUT [--player N] [--type T]
+       file_ops.py --test
+FILTER options: --min-samples N --max-samples N --players N,N...
+                --min-emg-peak V --max-emg-peak V
+PATTERN is formatted with {player}, {type} and {part}, e.g.
+'p{player}_{type}.dat'. --test runs the unit tests.
+"""
+
+from __future__ import print_function
+import argparse
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np                                      # pylint: disable=wrong-import-position
+
+from myoraw.data_file import (CorruptedFileError,      # pylint: disable=wrong-import-position
+                              FileHeader, GestureHeader,
+                              GestureSample, GestureType,
+                              Recording)
+
+COPY_CHUNK = 1 << 20
+
+
+class GestureRef(object):               # pylint: disable=too-few-public-methods
+    """Where a gesture lies in an open recording file."""
+
+    def __init__(self, bin_file, file_header, header, index, data_offset):
+        self.bin_file = bin_file
+        self.file_header = file_header
+        self.header = header
+        self.index = index
+        self.data_offset = data_offset
+        self.size = header.samples_nbr * GestureSample.struct_size
+
+    def samples(self):
+        """Decodes the gesture's samples into a (samples, 18) array."""
+        self.bin_file.seek(self.data_offset)
+        data = np.frombuffer(self.bin_file.read(self.size), "<i4")
+        return data.reshape((self.header.samples_nbr, -1))
+
+
+def iter_gestures(path):
+    """Yields a GestureRef for every gesture of a file, reading headers only.
+    A ref is only usable until the next one is yielded."""
+    with open(path, "rb") as bin_file:
+        file_header = FileHeader.unpack_from_file(bin_file)
+        version = file_header.version
+        offset = FileHeader.size(version)
+        for i in range(file_header.get_gestures_nbr()):
+            bin_file.seek(offset)
+            header = GestureHeader.unpack_from_file(bin_file, version)
+            ref = GestureRef(bin_file, file_header, header, i,
+                             offset + GestureHeader.size(version))
+            if header.samples_nbr <= 0 or \
+               header.next_gesture_offset != ref.data_offset + ref.size:
+                raise CorruptedFileError("%s: inconsistent header of gesture %d"
+                                         % (path, i))
+            yield ref
+            offset = ref.data_offset + ref.size
+
+
+class RecordingWriter(object):
+    """Writes a recording file gesture by gesture, copying them from other
+    files. Gestures must all come from recordings of the same player and
+    gesture type, unless those are given."""
+
+    def __init__(self, path, player_id=None, gesture_type=None):
+        self.path = path
+        # Header values given here override the inputs'.
+        self.values = {}
+        if player_id is not None:
+            self.values["player_id"] = player_id
+        if gesture_type is not None:
+            self.values["gesture_type"] = gesture_type
+        self.given = set(self.values)
+        self.gestures_nbr = 0
+        # The output only replaces path once complete, as it may be an input.
+        self.temp_path = "%s.%d.tmp" % (path, os.getpid())
+        self.bin_file = open(self.temp_path, "wb")
+        # Room for the file header, written on close.
+        FileHeader().pack_into_file(self.bin_file)
+
+    def _check(self, file_header):
+        """Adopts the header values of the first gesture's recording, and
+        makes sure the others match."""
+        for attr in ("player_id", "gesture_type", "rec_frame_rate"):
+            if attr in self.given:
+                continue
+            value = getattr(file_header, attr)
+            if self.values.setdefault(attr, value) != value:
+                raise ValueError("%s: inputs have different %s values"
+                                 % (self.path, attr))
+
+    def copy_gesture(self, ref):
+        """Appends the gesture of a GestureRef, checking its checksum."""
+        self._check(ref.file_header)
+
+        offset = self.bin_file.tell()
+        header = GestureHeader(ref.header.samples_nbr,
+                               offset + GestureHeader.struct_size + ref.size, 0)
+        header.pack_into_file(self.bin_file)
+
+        crc = 0
+        ref.bin_file.seek(ref.data_offset)
+        remaining = ref.size
+        while remaining:
+            data = ref.bin_file.read(min(COPY_CHUNK, remaining))
+            if not data:
+                raise CorruptedFileError("%s: gesture %d is truncated"
+                                         % (ref.bin_file.name, ref.index))
+            crc = zlib.crc32(data, crc)
+            self.bin_file.write(data)
+            remaining -= len(data)
+
+        header.crc = crc & 0xffffffff
+        if ref.header.crc is not None and ref.header.crc != header.crc:
+            raise CorruptedFileError("%s: checksum mismatch in gesture %d"
+                                     % (ref.bin_file.name, ref.index))
+        self.bin_file.seek(offset)
+        header.pack_into_file(self.bin_file)
+        self.bin_file.seek(0, os.SEEK_END)
+        self.gestures_nbr += 1
+
+    def finish(self):
+        """Writes the file header and closes the file, which only replaces
+        path on commit(); returns the number of gestures written."""
+        self.bin_file.seek(0)
+        FileHeader(self.values["player_id"], self.values["gesture_type"],
+                   self.values["rec_frame_rate"],
+                   self.gestures_nbr).pack_into_file(self.bin_file)
+        self.bin_file.close()
+        return self.gestures_nbr
+
+    def commit(self):
+        """Moves the finished file to its path."""
+        os.replace(self.temp_path, self.path)
+
+    def close(self):
+        """Finishes the file and moves it to its path; returns the number of
+        gestures written. Nothing is written if there are none, as a
+        recording can't be empty."""
+        if not self.gestures_nbr:
+            self.discard()
+            return 0
+        self.finish()
+        self.commit()
+        return self.gestures_nbr
+
+    def discard(self):
+        """Closes and removes the file, e.g. after an error; path is left
+        untouched."""
+        self.bin_file.close()
+        os.remove(self.temp_path)
+
+
+class Filter(object):                   # pylint: disable=too-few-public-methods
+    """A predicate on gestures. Conditions on sample counts and players only
+    need headers; those on EMG values decode the gesture."""
+
+    def __init__(self, min_samples=None, max_samples=None, players=None,
+                 min_emg_peak=None, max_emg_peak=None):
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.players = players
+        self.min_emg_peak = min_emg_peak
+        self.max_emg_peak = max_emg_peak
+
+    def __call__(self, ref):
+        samples_nbr = ref.header.samples_nbr
+        if self.min_samples is not None and samples_nbr < self.min_samples:
+            return False
+        if self.max_samples is not None and samples_nbr > self.max_samples:
+            return False
+        if self.players is not None and ref.file_header.player_id not in self.players:
+            return False
+        if self.min_emg_peak is None and self.max_emg_peak is None:
+            return True
+        peak = np.abs(ref.samples()[:, :8]).max()
+        if self.min_emg_peak is not None and peak < self.min_emg_peak:
+            return False
+        return self.max_emg_peak is None or peak <= self.max_emg_peak
+
+
+def concat(inputs, output, predicate=None, player_id=None, gesture_type=None):
+    """Writes the gestures of the input files accepted by predicate into
+    output, in order. Returns the number of gestures written."""
+    writer = RecordingWriter(output, player_id, gesture_type)
+    try:
+        for path in inputs:
+            for ref in iter_gestures(path):
+                if predicate is None or predicate(ref):
+                    writer.copy_gesture(ref)
+    except BaseException:
+        writer.discard()
+        raise
+    return writer.close()
+
+
+def relabel(input_path, output, player_id=None, gesture_type=None):
+    """Copies a recording, changing its player and/or gesture type."""
+    return concat([input_path], output, None, player_id, gesture_type)
+
+
+def split(inputs, pattern, by, predicate=None):
+    """Distributes the gestures of the input files accepted by predicate
+    among outputs named after pattern: one per player and gesture type, or
+    parts of by gestures of a player and gesture type if by is a number
+    (each finished as soon as it is full). Outputs only replace their paths
+    once all are complete. Returns a dict of the numbers of gestures
+    written, by output path."""
+    if by not in ("player", "type") and by < 1:
+        raise ValueError("split by %r: parts need at least 1 gesture" % (by,))
+    writers = {}
+    finished = []
+    counts = {}
+    try:
+        for path in inputs:
+            for ref in iter_gestures(path):
+                if predicate is not None and not predicate(ref):
+                    continue
+                fields = {"player": ref.file_header.player_id,
+                          "type": GestureType(ref.file_header.gesture_type).name.lower()}
+                pair = (fields["player"], fields["type"])
+                index = counts[pair] = counts.get(pair, 0) + 1
+                fields["part"] = (index - 1) // by if by not in ("player", "type") else 0
+                key = pair + (fields["part"],)
+                if key not in writers:
+                    output = pattern.format(**fields)
+                    if any(w.path == output for w in finished + list(writers.values())):
+                        raise ValueError("%s: the pattern must tell apart the gestures of "
+                                         "player %d, type %s from others"
+                                         % (output, fields["player"], fields["type"]))
+                    writers[key] = RecordingWriter(output)
+                writers[key].copy_gesture(ref)
+                if by not in ("player", "type") and index % by == 0:
+                    writers[key].finish()
+                    finished.append(writers.pop(key))
+        for writer in writers.values():
+            writer.finish()
+        finished += writers.values()
+        writers = {}
+    except BaseException:
+        for writer in finished + list(writers.values()):
+            writer.discard()
+        raise
+    written = {}
+    for writer in finished:
+        writer.commit()
+        written[writer.path] = writer.gestures_nbr
+    return written
+
+
+def _gesture_type(value):
+    """Parses a gesture type given by name or number."""
+    if value.isdigit():
+        return GestureType(int(value))
+    return GestureType[value.upper()]
+
+
+def main():
+    """Runs an operation from the command line."""
+    try:
+        return _main()
+    except (ValueError, IOError) as error:
+        print("### ERROR: %s" % error)
+        return 1
+
+
+def _main():
+    """Parses the command line and runs the operation."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    for name in ("concat", "filter", "split", "relabel"):
+        command = commands.add_parser(name)
+        command.add_argument("output" if name != "split" else "pattern")
+        command.add_argument("inputs", nargs="+" if name in ("concat", "split") else 1)
+        if name in ("concat", "relabel"):
+            command.add_argument("--player", type=int)
+            command.add_argument("--type", type=_gesture_type)
+        if name == "split":
+            command.add_argument("--by", required=True)
+        if name != "relabel":
+            command.add_argument("--min-samples", type=int)
+            command.add_argument("--max-samples", type=int)
+            command.add_argument("--players", type=lambda s: [int(p) for p in s.split(",")])
+            command.add_argument("--min-emg-peak", type=int)
+            command.add_argument("--max-emg-peak", type=int)
+    args = parser.parse_args()
+
+    predicate = None
+    if args.command != "relabel":
+        predicate = Filter(args.min_samples, args.max_samples, args.players,
+                           args.min_emg_peak, args.max_emg_peak)
+    if args.command == "split":
+        by = int(args.by) if args.by.isdigit() else args.by
+        if by not in ("player", "type") and (not isinstance(by, int) or by < 1):
+            parser.error("--by must be player, type or a number of gestures")
+        outputs = split(args.inputs, args.pattern, by, predicate)
+        if not outputs:
+            raise ValueError("no gesture matched, nothing written")
+        for path, written in sorted(outputs.items()):
+            print("%s: %d gestures" % (path, written))
+        return 0
+
+    if args.command == "relabel":
+        written = relabel(args.inputs[0], args.output, args.player, args.type)
+    elif args.command == "filter":
+        written = concat(args.inputs, args.output, predicate)
+    else:
+        written = concat(args.inputs, args.output, predicate, args.player, args.type)
+    if not written:
+        # A recording can't be empty: an existing output is left as it was.
+        raise ValueError("%s: no gesture matched, nothing written" % args.output)
+    print("%s: %d gestures" % (args.output, written))
+    return 0
+
+
+################################################################################
+#     UNIT TESTS
+################################################################################
+
+def _read_test_recording(path):
+    """Returns the player, gesture type and gesture lengths of a recording,
+    checking that it is valid. Test gestures are told apart by their
+    lengths."""
+    from tools.integrity import scan_file
+    assert scan_file(path)["error"] is None
+    with open(path, "rb") as bin_file:
+        recording = Recording.unpack_from_file(bin_file)
+    for gesture in recording.gestures:
+        for j, sample in enumerate(gesture.samples):
+            assert sample.acc == (j,) * 3
+    return (recording.file_header.player_id, recording.file_header.gesture_type,
+            [g.header.samples_nbr for g in recording.gestures])
+
+
+def unit_test_concat_and_filter():
+    """Tests concat, filter and relabel, in place and with legacy inputs."""
+
+    from tools.integrity import write_test_recording
+    print ("    - Testing concat, filter and relabel...")
+
+    smash, clear = GestureType.FOREHAND_SMASH, GestureType.FOREHAND_CLEAR
+    directory = tempfile.mkdtemp()
+    try:
+        def path(name):
+            return os.path.join(directory, name)
+        write_test_recording(path("a.dat"), [3, 4, 5], 1, smash)
+        write_test_recording(path("b.dat"), [6, 7], 1, smash)
+        write_test_recording(path("c.dat"), [8], 2, clear)
+
+        assert concat([path("a.dat"), path("b.dat")], path("ab.dat")) == 5
+        assert _read_test_recording(path("ab.dat")) == (1, smash, [3, 4, 5, 6, 7])
+
+        # Different players or types need to be overridden.
+        try:
+            concat([path("a.dat"), path("c.dat")], path("ac.dat"))
+        except ValueError:
+            pass
+        else:
+            assert False
+        assert sorted(os.listdir(directory)) == ["a.dat", "ab.dat", "b.dat", "c.dat"]
+        assert concat([path("a.dat"), path("c.dat")], path("ac.dat"), None, 3, clear) == 4
+        assert _read_test_recording(path("ac.dat")) == (3, clear, [3, 4, 5, 8])
+
+        # Filters, one matching nothing: the output is left alone.
+        assert concat([path("ab.dat")], path("ab.dat"), Filter(4, 6)) == 3
+        assert _read_test_recording(path("ab.dat")) == (1, smash, [4, 5, 6])
+        assert concat([path("ab.dat")], path("ab.dat"), Filter(players=[2])) == 0
+        assert _read_test_recording(path("ab.dat")) == (1, smash, [4, 5, 6])
+        # The EMG peak of gesture i of n samples is 1000 * i + n - 1.
+        assert concat([path("ac.dat")], path("peak.dat"), Filter(min_emg_peak=1000)) == 2
+        assert _read_test_recording(path("peak.dat")) == (3, clear, [4, 5])
+
+        # Relabeling a file onto itself.
+        assert relabel(path("c.dat"), path("c.dat"), 4, smash) == 1
+        assert _read_test_recording(path("c.dat")) == (4, smash, [8])
+
+        # Version 1 inputs are copied into a version 2 file.
+        samples = b"".join(GestureSample([j] * 8, [0] * 4, [j] * 3, [0] * 3).pack()
+                           for j in range(2))
+        with open(path("v1.dat"), "wb") as bin_file:
+            bin_file.write(struct.pack("<iiii", 1, smash, 20, 1))
+            bin_file.write(struct.pack("<ii", 2, 16 + 8 + len(samples)))
+            bin_file.write(samples)
+        assert concat([path("v1.dat"), path("b.dat")], path("v2.dat")) == 3
+        assert _read_test_recording(path("v2.dat")) == (1, smash, [2, 6, 7])
+
+        # A corrupted input leaves nothing behind.
+        with open(path("b.dat"), "r+b") as bin_file:
+            bin_file.seek(-1, os.SEEK_END)
+            byte = bin_file.read(1)
+            bin_file.seek(-1, os.SEEK_END)
+            bin_file.write(struct.pack("B", ord(byte) ^ 1))
+        try:
+            concat([path("a.dat"), path("b.dat")], path("a.dat"))
+        except CorruptedFileError:
+            pass
+        else:
+            assert False
+        assert _read_test_recording(path("a.dat")) == (1, smash, [3, 4, 5])
+        assert not [name for name in os.listdir(directory) if name.endswith(".tmp")]
+    finally:
+        shutil.rmtree(directory)
+
+
+def unit_test_split():
+    """Tests split by player, type and number, and split round-trips."""
+
+    from tools.integrity import write_test_recording
+    print ("    - Testing split...")
+
+    smash, clear = GestureType.FOREHAND_SMASH, GestureType.FOREHAND_CLEAR
+    directory = tempfile.mkdtemp()
+    try:
+        def path(name):
+            return os.path.join(directory, name)
+        write_test_recording(path("a.dat"), [3, 4, 5], 1, smash)
+        write_test_recording(path("b.dat"), [6, 7], 2, smash)
+        write_test_recording(path("c.dat"), [8, 9], 1, clear)
+        inputs = [path("a.dat"), path("b.dat"), path("c.dat")]
+
+        written = split(inputs, path("p{player}_{type}.dat"), "type")
+        assert written == {path("p1_forehand_smash.dat"): 3,
+                           path("p2_forehand_smash.dat"): 2,
+                           path("p1_forehand_clear.dat"): 2}
+        assert _read_test_recording(path("p1_forehand_clear.dat")) == (1, clear, [8, 9])
+
+        # Parts of 2 gestures, counted per player and type.
+        written = split(inputs, path("{type}_p{player}_{part}.dat"), 2)
+        assert written == {path("forehand_smash_p1_0.dat"): 2,
+                           path("forehand_smash_p1_1.dat"): 1,
+                           path("forehand_smash_p2_0.dat"): 2,
+                           path("forehand_clear_p1_0.dat"): 2}
+        parts = [path("forehand_smash_p1_0.dat"), path("forehand_smash_p1_1.dat")]
+        assert concat(parts, path("joined.dat")) == 3
+        assert _read_test_recording(path("joined.dat")) == _read_test_recording(inputs[0])
+
+        # With a filter, and by player alone, which can't tell types apart.
+        written = split(inputs, path("f{player}_{type}.dat"), "player", Filter(min_samples=5))
+        assert written == {path("f1_forehand_smash.dat"): 1,
+                           path("f2_forehand_smash.dat"): 2,
+                           path("f1_forehand_clear.dat"): 2}
+        for pattern, by in (("q{player}.dat", "player"), ("q{part}.dat", 2), ("q.dat", 1)):
+            try:
+                split(inputs, path(pattern), by)
+            except ValueError:
+                pass
+            else:
+                assert False
+        try:
+            split(inputs, path("r{player}_{type}_{part}.dat"), 0)
+        except ValueError:
+            pass
+        else:
+            assert False
+        assert not [name for name in os.listdir(directory)
+                    if name.startswith(("q", "r")) or name.endswith(".tmp")]
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--test"]:
+        print ("Testing file_ops module:")
+        unit_test_concat_and_filter()
+        unit_test_split()
+        print ("Test succeeded.")
+        sys.exit(0)
+    sys.exit(main())
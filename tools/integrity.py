@@ -0,0 +1,275 @@
+# Copyright (c) 2015 Gilles Lourdelet
+# MIT Licence (MIT)
+# Please see LICENSE file for details.
+"""This module checks recording files, and repairs the truncated ones.
+
+A file is checked by jumping from gesture header to gesture header through
+next_gesture_offset, without decoding any sample: each header must be
+consistent with its sample count and the file size, and, since format
+version 2, the samples must match the header's CRC32.
+
+A file cut short, e.g. by a crashed session, is repaired by keeping the
+gestures before the first invalid one: the file is truncated after them and
+its header's gestures_nbr rewritten. The original file is kept with a .bak
+extension, unless --no-backup is given.
+
+Usage: integrity.py [--repair] [--no-backup] [--no-crc] [--processes N]
+                    PATH...
+       integrity.py --test
+PATHs may be files or directories, searched recursively for .dat files.
+--test runs the unit tests.
+"""
+
+from __future__ import print_function
+import argparse
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from myoraw.data_file import (FileHeader, Gesture,       # pylint: disable=wrong-import-position
+                              GestureHeader, GestureSample,
+                              GestureType, Recording)
+
+
+def scan_file(path, check_crc=True):
+    """Checks a recording file. Returns a dict with the file's path, size and
+    format version, the number of gestures declared and of valid ones before
+    the first problem, the offset right after those and a description of the
+    problem (None for a valid file)."""
+    report = {"path": path, "size": os.path.getsize(path), "version": None,
+              "declared": 0, "valid": 0, "valid_end": 0, "error": None}
+    with open(path, "rb") as bin_file:
+        try:
+            file_header = FileHeader.unpack_from_file(bin_file)
+        except IOError as error:
+            report["error"] = str(error)
+            return report
+        version = file_header.version
+        report["version"] = version
+        report["declared"] = file_header.get_gestures_nbr()
+        offset = report["valid_end"] = FileHeader.size(version)
+        header_size = GestureHeader.size(version)
+
+        for i in range(report["declared"]):
+            bin_file.seek(offset)
+            try:
+                header = GestureHeader.unpack_from_file(bin_file, version)
+            except IOError:
+                report["error"] = "truncated in the header of gesture %d" % i
+                return report
+            end = offset + header_size + header.samples_nbr * GestureSample.struct_size
+            if header.samples_nbr <= 0 or header.next_gesture_offset != end:
+                report["error"] = "inconsistent header of gesture %d" % i
+                return report
+            if end > report["size"]:
+                report["error"] = "truncated in the samples of gesture %d" % i
+                return report
+            if check_crc and not header.check_crc(bin_file.read(end - offset - header_size)):
+                report["error"] = "checksum mismatch in gesture %d" % i
+                return report
+            offset = report["valid_end"] = end
+            report["valid"] = i + 1
+
+    if report["declared"] <= 0:
+        report["error"] = "no gesture declared"
+    elif offset != report["size"]:
+        report["error"] = "%d bytes after the last gesture" % (report["size"] - offset)
+    return report
+
+
+def repair_file(report, backup=True):
+    """Repairs the file of a scan_file report by keeping its valid gestures.
+    Returns False if it has none to keep."""
+    if not report["valid"]:
+        return False
+    path = report["path"]
+    if backup:
+        shutil.copy2(path, path + ".bak")
+    with open(path, "r+b") as bin_file:
+        # gestures_nbr is the last member of the file header.
+        bin_file.seek(FileHeader.size(report["version"]) - 4)
+        bin_file.write(struct.pack("<i", report["valid"]))
+        bin_file.truncate(report["valid_end"])
+    return True
+
+
+def _scan_worker(args):
+    """scan_file for a pool."""
+    return scan_file(*args)
+
+
+def find_files(paths):
+    """Yields the given files, and the .dat files found under the given
+    directories."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dir_path, _, file_names in os.walk(path):
+            for file_name in sorted(file_names):
+                if file_name.endswith(".dat"):
+                    yield os.path.join(dir_path, file_name)
+
+
+def scan_files(paths, check_crc=True, processes=None):
+    """Checks many files in parallel; yields their reports as they come."""
+    tasks = [(path, check_crc) for path in paths]
+    if processes == 1 or len(tasks) < 2:
+        for task in tasks:
+            yield _scan_worker(task)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        for report in pool.imap_unordered(_scan_worker, tasks, chunksize=16):
+            yield report
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main():
+    """Checks (and repairs) files from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--repair", action="store_true",
+                        help="truncate corrupted files after their last valid gesture")
+    parser.add_argument("--no-backup", action="store_true")
+    parser.add_argument("--no-crc", action="store_true",
+                        help="only check the structure, without reading samples")
+    parser.add_argument("--processes", type=int)
+    args = parser.parse_args()
+
+    checked = corrupted = repaired = 0
+    for report in scan_files(list(find_files(args.paths)), not args.no_crc,
+                             args.processes):
+        checked += 1
+        if report["error"] is None:
+            continue
+        corrupted += 1
+        print("%s: %s (%d/%d gestures valid)" % (report["path"], report["error"],
+                                                report["valid"], report["declared"]))
+        if args.repair:
+            if repair_file(report, not args.no_backup):
+                repaired += 1
+                print("    repaired, %d gestures kept" % report["valid"])
+            else:
+                print("    nothing to salvage")
+
+    print("%d files checked, %d corrupted, %d repaired" % (checked, corrupted, repaired))
+    return 1 if corrupted > repaired else 0
+
+
+################################################################################
+#     UNIT TESTS
+################################################################################
+
+def write_test_recording(path, samples_nbrs, player_id=42,
+                         gesture_type=GestureType.FOREHAND_SMASH):
+    """Writes a recording with a gesture of each given number of samples,
+    their values telling the gesture and sample apart."""
+    recording = Recording()
+    recording.set_player_id(player_id)
+    recording.set_gesture_type(gesture_type)
+    for i, samples_nbr in enumerate(samples_nbrs):
+        gesture = Gesture()
+        for j in range(samples_nbr):
+            gesture.append_sample([1000 * i + j] * 8, [i] * 4, [j] * 3, [-j] * 3)
+        recording.append_gesture(gesture)
+    with open(path, "wb") as bin_file:
+        recording.pack_into_file(bin_file)
+
+
+def unit_test_scan_and_repair():
+    """Tests the detection and repair of truncated and corrupted files."""
+
+    print ("    - Testing scan and repair...")
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "test.dat")
+        header_size = FileHeader.size(2)
+        gesture_size = GestureHeader.size(2) + 10 * GestureSample.struct_size
+
+        write_test_recording(path, [10, 10, 10])
+        report = scan_file(path)
+        assert report["error"] is None
+        assert (report["declared"], report["valid"]) == (3, 3)
+        size = report["size"]
+
+        # Cut in the samples of the last gesture.
+        with open(path, "r+b") as bin_file:
+            bin_file.truncate(size - 5)
+        report = scan_file(path)
+        assert report["error"] == "truncated in the samples of gesture 2"
+        assert report["valid"] == 2
+        assert report["valid_end"] == header_size + 2 * gesture_size
+        assert repair_file(report)
+        assert os.path.getsize(path + ".bak") == size - 5
+        assert scan_file(path)["error"] is None
+        with open(path, "rb") as bin_file:
+            recording = Recording.unpack_from_file(bin_file)
+        assert len(recording.gestures) == 2
+        assert recording.gestures[1].samples[9].emg == (1009,) * 8
+
+        # A flipped bit in the samples of the second gesture.
+        write_test_recording(path, [10, 10, 10])
+        with open(path, "r+b") as bin_file:
+            bin_file.seek(header_size + gesture_size + GestureHeader.size(2) + 3)
+            byte = bin_file.read(1)
+            bin_file.seek(-1, os.SEEK_CUR)
+            bin_file.write(struct.pack("B", ord(byte) ^ 1))
+        report = scan_file(path)
+        assert report["error"] == "checksum mismatch in gesture 1"
+        assert scan_file(path, check_crc=False)["error"] is None
+        assert repair_file(report, backup=False)
+        assert scan_file(path)["valid"] == scan_file(path)["declared"] == 1
+
+        # Bytes after the last gesture, then a header that lies.
+        write_test_recording(path, [10, 10])
+        with open(path, "ab") as bin_file:
+            bin_file.write(b"\0" * 7)
+        report = scan_file(path)
+        assert report["error"] == "7 bytes after the last gesture"
+        assert repair_file(report, backup=False)
+        assert scan_file(path)["error"] is None
+        with open(path, "r+b") as bin_file:
+            bin_file.seek(header_size)
+            bin_file.write(struct.pack("<i", 11))
+        report = scan_file(path)
+        assert report["error"] == "inconsistent header of gesture 0"
+        assert not repair_file(report)
+
+        # Too short for a file header.
+        with open(path, "wb") as bin_file:
+            bin_file.write(b"MYO")
+        report = scan_file(path)
+        assert report["error"] is not None and not repair_file(report)
+
+        # Files in directories, checked in parallel.
+        write_test_recording(path, [10])
+        os.remove(path + ".bak")
+        write_test_recording(os.path.join(directory, "other.dat"), [5, 5])
+        with open(os.path.join(directory, "notes.txt"), "w") as text_file:
+            text_file.write("not a recording")
+        paths = list(find_files([directory]))
+        assert len(paths) == 2
+        reports = list(scan_files(paths, processes=2))
+        assert sorted(r["valid"] for r in reports) == [1, 2]
+        assert all(r["error"] is None for r in reports)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--test"]:
+        print ("Testing integrity module:")
+        unit_test_scan_and_repair()
+        print ("Test succeeded.")
+        sys.exit(0)
+    sys.exit(main())
@@ -0,0 +1,272 @@
+# Copyright (c) 2015 Gilles Lourdelet
+# MIT Licence (MIT)
+# Please see LICENSE file for details.
+"""This module tunes the parameters of the real-time pipeline on recorded
+sessions: every configuration of a grid is evaluated by replaying held-out
+gestures through a whole Myo (packet framing, decoding, classification and
+decision engine) as fast as they can be processed.
+
+For each configuration it reports:
+- accuracy: the fraction of emitted decisions that matched the gesture being
+  performed when they were made;
+- recognized: the fraction of gestures for which a correct decision came,
+  among those following a gesture of another type (the others need none);
+- latency: the time from the start of such a gesture to its first correct
+  decision, at the configuration's EMG rate;
+- cpu: the processor time spent per EMG sample.
+
+The sensor settings can only be emulated from what was recorded: emg_hz
+resamples the recorded EMG from the frame rate stored in its recording file,
+and emg_smooth above the recorded MyoRaw.EMG_SMOOTH adds a moving average
+(smoothing can't be removed). imu_hz sets how many IMU packets
+are interleaved with the EMG ones, which only changes the cost.
+
+Usage: sweep.py [--grid NAME=V1,V2...]... [--folds players|K] [--processes N]
+                [--seed N] [--out FILE] RECORDING...
+"""
+
+from __future__ import print_function
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import struct
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np                                      # pylint: disable=wrong-import-position
+
+from myoraw.decision import EarlyDecision               # pylint: disable=wrong-import-position
+from myoraw.dtw import resample                         # pylint: disable=wrong-import-position
+from myoraw.myo_raw import MyoRaw                       # pylint: disable=wrong-import-position
+from tools.evaluate import (COLUMNS, Catalog,           # pylint: disable=wrong-import-position
+                            kfold_folds, player_folds)
+
+# Parameters that can be swept, with their type and default value.
+PARAMS = {
+    "subsample": (int, 3),
+    "k": (int, 15),
+    "confidence": (float, 0.9),
+    "max_latency": (int, 25),
+    "prior": (float, 1.0),
+    "emg_hz": (int, MyoRaw.EMG_HZ),
+    "emg_smooth": (int, MyoRaw.EMG_SMOOTH),
+    "imu_hz": (int, MyoRaw.IMU_HZ),
+}
+
+_EMG_PACKET = struct.Struct("<BBBBBHBB8HB")
+_IMU_PACKET = struct.Struct("<BBBBBHBB10h")
+
+
+def emulate_sensor(emg, config, rate=MyoRaw.EMG_HZ):
+    """Returns the EMG samples of a gesture recorded at rate as they would
+    have been with the configuration's sensor settings."""
+    emg = np.asarray(emg, np.float64)
+    if config["emg_hz"] != rate:
+        length = max(1, int(round(len(emg) * config["emg_hz"] / float(rate))))
+        emg = resample(emg, length)
+    window = int(round(config["emg_smooth"] / float(MyoRaw.EMG_SMOOTH)))
+    if window > 1:
+        cum = np.cumsum(np.vstack([np.zeros((1, emg.shape[1])), emg]), 0)
+        start = np.maximum(np.arange(1, len(emg) + 1) - window, 0)
+        emg = (cum[1:] - cum[start]) / (np.arange(1, len(emg) + 1) - start)[:, None]
+    return np.clip(np.round(emg), 0, 0xffff).astype(np.int64)
+
+
+def packet_stream(emg, imu, imu_hz, emg_hz):
+    """Returns the bytes the dongle would send for these EMG samples, with
+    IMU notifications interleaved at imu_hz."""
+    chunks = []
+    imu_due = 0.
+    j = 0
+    for vals in emg:
+        chunks.append(_EMG_PACKET.pack(0x80, _EMG_PACKET.size - 4, 4, 5,
+                                       0, 0x27, 0, 18, *(tuple(vals) + (0,))))
+        imu_due += imu_hz / float(emg_hz)
+        while imu_due >= 1 and len(imu):
+            chunks.append(_IMU_PACKET.pack(0x80, _IMU_PACKET.size - 4, 4, 5,
+                                           0, 0x1c, 0, 20, *imu[j % len(imu)]))
+            imu_due -= 1
+            j += 1
+    return b"".join(chunks)
+
+
+def replay(catalog, config, train, test, seed=0):
+    """Trains a Myo's classifier on the train gestures, replays the test ones
+    to it in a random order, and returns its score for config."""
+    from myoraw.myo import Myo, NNClassifier
+    emg_columns = COLUMNS["emg"]
+    imu_columns = slice(COLUMNS["quat"].start, COLUMNS["gyro"].stop)
+
+    X = [emulate_sensor(catalog.gesture(i)[:, emg_columns], config, catalog.rates[i])
+         for i in train]
+    Y = np.repeat(catalog.labels[train], [len(x) for x in X])
+    cls = NNClassifier.from_arrays(np.vstack(X), Y, config["subsample"], config["k"])
+    decision = EarlyDecision(len(cls.counts), config["confidence"],
+                             config["max_latency"], config["prior"])
+    m = Myo(cls, "loop://", decision)
+    m.bt.add_handler(m.handle_data)
+
+    # The label being performed at each EMG sample, and the decisions made,
+    # with the sample that triggered them; the handler appending to truth
+    # runs after the classification.
+    truth = []
+    decisions = []
+    label = [None]
+    m.add_raw_pose_handler(lambda pose: decisions.append((len(truth), pose)))
+    m.add_emg_handler(lambda emg, moving: truth.append(label[0]))
+
+    order = np.random.RandomState(seed).permutation(test)
+    starts = []
+    cpu = 0.
+    for i in order:
+        gesture = catalog.gesture(i)
+        emg = emulate_sensor(gesture[:, emg_columns], config, catalog.rates[i])
+        imu = np.clip(gesture[:, imu_columns], -0x8000, 0x7fff).tolist()
+        stream = packet_stream(emg, imu, config["imu_hz"], config["emg_hz"])
+        starts.append(len(truth))
+        label[0] = catalog.labels[i]
+
+        proc_byte, handle_event = m.bt.proc_byte, m.bt.handle_event
+        start = time.process_time()
+        for c in stream:
+            packet = proc_byte(c)
+            if packet:
+                handle_event(packet)
+        cpu += time.process_time() - start
+    m.bt.ser.close()
+
+    correct = sum(1 for t, pose in decisions if pose == truth[t])
+    latencies = []
+    changes = [g for g in range(len(starts))
+               if g == 0 or catalog.labels[order[g]] != catalog.labels[order[g - 1]]]
+    for g in changes:
+        start = starts[g]
+        end = starts[g + 1] if g + 1 < len(starts) else len(truth)
+        hits = [t for t, pose in decisions if start <= t < end and pose == truth[t]]
+        if hits:
+            latencies.append((hits[0] - start + 1) / float(config["emg_hz"]))
+    return {"decisions": len(decisions), "correct": correct,
+            "gestures": len(changes), "recognized": len(latencies),
+            "latencies": latencies, "samples": len(truth), "cpu": cpu}
+
+
+def summarize(config, results):
+    """Sums up the replays of the folds of one configuration."""
+    decisions = sum(r["decisions"] for r in results)
+    latencies = [l for r in results for l in r["latencies"]]
+    return {
+        "config": config,
+        "accuracy": float(sum(r["correct"] for r in results)) / max(decisions, 1),
+        "recognized": (float(sum(r["recognized"] for r in results)) /
+                       max(sum(r["gestures"] for r in results), 1)),
+        "latency_mean": float(np.mean(latencies)) if latencies else float("nan"),
+        "latency_p90": float(np.percentile(latencies, 90)) if latencies else float("nan"),
+        "cpu_per_sample": (sum(r["cpu"] for r in results) /
+                           max(sum(r["samples"] for r in results), 1)),
+    }
+
+
+def make_grid(specs):
+    """Returns the list of configurations made of every combination of the
+    NAME=V1,V2... specs, other parameters keeping their default."""
+    axes = []
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in PARAMS:
+            raise ValueError("unknown parameter %s (one of %s)"
+                             % (name, ", ".join(sorted(PARAMS))))
+        axes.append([(name, PARAMS[name][0](v)) for v in values.split(",")])
+    defaults = dict((name, default) for name, (_, default) in PARAMS.items())
+    return [dict(defaults, **dict(combination)) for combination in itertools.product(*axes)]
+
+
+# Catalog of a worker process and its shared-memory blocks, set once per
+# worker.
+_worker_catalog = None
+_worker_blocks = None
+
+
+def _init_worker(specs):
+    """Maps the shared catalog."""
+    global _worker_catalog, _worker_blocks  # pylint: disable=global-statement
+    _worker_catalog, _worker_blocks = Catalog.attach(specs)
+
+
+def _replay_worker(task):
+    """Runs one (configuration, fold) replay on the shared catalog."""
+    return replay(_worker_catalog, *task)
+
+
+def sweep(catalog, configs, folds, processes=None, seed=0):
+    """Replays every fold with every configuration; returns the summaries,
+    best first."""
+    everything = np.arange(len(catalog))
+    tasks = [(config, np.setdiff1d(everything, test), test, seed)
+             for config in configs for _, test in folds]
+    if processes == 1:
+        results = [replay(catalog, *task) for task in tasks]
+    else:
+        blocks, specs = catalog.share()
+        try:
+            pool = multiprocessing.Pool(processes, _init_worker, (specs,))
+            try:
+                results = pool.map(_replay_worker, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    summaries = [summarize(config, results[c * len(folds):(c + 1) * len(folds)])
+                 for c, config in enumerate(configs)]
+    summaries.sort(key=lambda s: (-s["accuracy"] * s["recognized"], s["latency_mean"]))
+    return summaries
+
+
+def main():
+    """Runs a sweep from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("recordings", nargs="+")
+    parser.add_argument("--grid", action="append", default=[],
+                        help="NAME=V1,V2... with NAME one of %s (repeatable)"
+                        % ", ".join(sorted(PARAMS)))
+    parser.add_argument("--folds", default="players",
+                        help="'players' to leave one player out, or a number of folds")
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    catalog = Catalog.load(args.recordings)
+    if args.folds == "players":
+        folds = player_folds(catalog)
+    else:
+        folds = kfold_folds(catalog, int(args.folds), args.seed)
+    configs = make_grid(args.grid)
+    swept = [spec.partition("=")[0] for spec in args.grid]
+
+    print("%d configurations x %d folds, %d gestures"
+          % (len(configs), len(folds), len(catalog)))
+    summaries = sweep(catalog, configs, folds, args.processes, args.seed)
+    print("%-40s %8s %10s %12s %12s" % (" ".join(swept) or "defaults", "accuracy",
+                                        "recognized", "latency (ms)", "cpu (us)"))
+    for s in summaries:
+        print("%-40s %8.3f %10.3f %12.0f %12.1f" % (
+            " ".join(str(s["config"][name]) for name in swept),
+            s["accuracy"], s["recognized"], s["latency_mean"] * 1e3,
+            s["cpu_per_sample"] * 1e6))
+    if args.out:
+        with open(args.out, "w") as out_file:
+            json.dump(summaries, out_file, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())